@@ -1,15 +1,22 @@
 import os
-import gradio as gr
-from audiocraft.models import MAGNeT, MusicGen, AudioGen
 
+from gradio_components.startup import print_startup_report, timed_import
+
+# torch, audiocraft and basic-pitch (TensorFlow) are only imported once a tab needs them
+gr = timed_import("gradio")
+timed_import("gradio_components.image")
+timed_import("gradio_components.prediction")
 # from gradio_components.image import generate_caption, improve_prompt
 from gradio_components.image import generate_caption_gpt4
-from gradio_components.prediction import predict, transcribe
+from gradio_components.metrics import render as render_metrics
+from gradio_components.outputs import OUTPUT_FORMATS
+from gradio_components.precision import PRECISIONS
+from gradio_components.results import GenerationResult
+from gradio_components.prediction import cancel_handler, cancel_requests, predict, predict_long, predict_stream, transcription_results, clip_value, clip_store, compiled_lm, model_registry, batch_scheduler, audio_cache, artifact_store, prewarmer, start_workers
 
 import re
 import argparse
 from gradio_components.model_cards import TEXT_TO_MIDI_MODELS, TEXT_TO_SOUND_MODELS, MELODY_CONTINUATION_MODELS, TEXT_TO_MUSIC_MODELS, MODEL_CARDS, MELODY_CONDITIONED_MODELS
-import ast
 import json
 
 
@@ -83,8 +90,67 @@ def generate_prompt(prompt, style):
     return prompt
 
 
-def UI(share=False):
-    with gr.Blocks() as demo:
+# audio players per tab, the most outputs a request can ask for
+MAX_OUTPUTS = 10
+
+
+def output_slots(result):
+    """`MAX_OUTPUTS` hidden audio players that show the clips of the `predict` result in `result`."""
+    slots = [
+        gr.Audio(label=f"Generated Music {i}", type='filepath', interactive=False, visible=False)
+        for i in range(MAX_OUTPUTS)
+    ]
+    # the clip of each slot, per session
+    shown = gr.State([None] * MAX_OUTPUTS)
+    result.change(fn=show_clips, inputs=[result, shown], outputs=slots + [shown], queue=False)
+    return slots
+
+
+def show_clips(result, shown):
+    """Updates of the `output_slots` for a `predict` result: its clips, the other slots hidden.
+
+    Only the slots whose clip changed are sent, a partial result while `predict` runs adds
+    its newly encoded clips without reloading the players of the previous ones.
+    """
+    clips = GenerationResult.from_dict(result).clips[:MAX_OUTPUTS] if result else []
+    # while `predict` runs, the clips still being encoded are None
+    clips = clips + [None] * (MAX_OUTPUTS - len(clips))
+    updates = []
+    for ref, previous in zip(clips, shown):
+        if ref == previous:
+            updates.append(gr.update())
+        elif ref is None:
+            updates.append(gr.Audio(value=None, visible=False))
+        else:
+            updates.append(gr.Audio(value=clip_value(ref), visible=True))
+    return updates + [clips]
+
+
+def add_health_routes(app):
+    """Liveness and readiness probes for the load balancer: `/readyz` answers 503
+    until every checkpoint passed to `--prewarm` is loaded and warmed up. `/metrics`
+    exposes the per-stage latency histograms in the Prometheus text format."""
+    from fastapi.responses import JSONResponse, PlainTextResponse
+
+    @app.get("/healthz")
+    def healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    def readyz():
+        readiness = prewarmer.readiness()
+        return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+    @app.get("/metrics")
+    def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+def UI(share=False, concurrency_limit=1, startup_report=False):
+    # gradio copies every served clip (bytes or file) to its own cache dir, which it never
+    # cleans by default: expire those copies with the files of the artifact store
+    delete_cache = (int(artifact_store.sweep_interval), int(artifact_store.file_lifetime))
+    with gr.Blocks(delete_cache=delete_cache) as demo:
         with gr.Tab("Generate Music by text"):
             with gr.Row():
                 with gr.Column():
@@ -106,7 +172,14 @@ def UI(share=False):
                             label="Number of outputs",
                             value=1,
                             minimum=1,
-                            maximum=10,
+                            maximum=MAX_OUTPUTS,
+                            interactive=True,
+                        )
+                        seed = gr.Number(
+                            label="Seed",
+                            value=-1,
+                            precision=0,
+                            info="-1 for random, a fixed seed reuses cached results",
                             interactive=True,
                         )
                    
@@ -163,25 +236,48 @@ def UI(share=False):
                         melody = gr.Audio(sources=["upload"], type="numpy", label="File",
                                         interactive=True, elem_id="melody-input", visible=False)
                         submit = gr.Button("Generate Music")
-                    result_text = gr.Textbox(label="Generated Music (text)", type="text", interactive=False)
-                    print(result_text)
-                    output_audios = []
-                    @gr.render(inputs=result_text)
-                    def show_output_audio(tmp_paths):
-                        if tmp_paths:
-                            tmp_paths = ast.literal_eval(tmp_paths)
-                            print(tmp_paths)
-                            for i in range(len(tmp_paths)):
-                                tmp_path = tmp_paths[i]
-                                _audio = gr.Audio(value=tmp_path , label=f"Generated Music {i}", type='filepath', interactive=False, visible=True)
-                                output_audios.append(_audio)
-                
-                    submit.click(
+                        stream_submit = gr.Button("Stream Music")
+                        stop = gr.Button("Stop", variant="stop")
+                    stream_audio = gr.Audio(label="Streaming", streaming=True, autoplay=True, interactive=False)
+                    result_text = gr.JSON(label="Generated Music (text)")
+                    output_audios = output_slots(result_text)
+
+                    submit_event = submit.click(
                         fn=predict,
-                        inputs=[model_path, config_output_textbox, text_prompt, melody, num_outputs], 
+                        inputs=[model_path, config_output_textbox, text_prompt, melody, num_outputs, seed], 
                         outputs=result_text,
+                        queue=True,
+                        # the only event whose requests are batched, the others run one at a time
+                        concurrency_limit=concurrency_limit,
+                        )
+                    stream_event = stream_submit.click(
+                        fn=predict_stream,
+                        inputs=[model_path, config_output_textbox, text_prompt],
+                        outputs=stream_audio,
+                        queue=True
+                        )
+
+                    with gr.Accordion("Long-form generation", open=False):
+                        with gr.Row():
+                            long_duration = gr.Number(
+                                label="Duration (seconds)",
+                                value=120,
+                                minimum=30,
+                                maximum=600,
+                                info="generated window by window beyond the 30 s limit, MusicGen models only",
+                                interactive=True,
+                            )
+                            long_prompt_wav = gr.Audio(sources=["upload"], type="filepath", label="Start from (optional)")
+                        long_submit = gr.Button("Generate Long Music")
+                        long_audio = gr.Audio(label="Long-form music", type="filepath", interactive=False)
+                    long_event = long_submit.click(
+                        fn=predict_long,
+                        inputs=[model_path, config_output_textbox, long_duration, text_prompt, long_prompt_wav],
+                        outputs=long_audio,
                         queue=True
                         )
+                    # stops the generation itself, not only the event in the browser
+                    stop.click(fn=cancel_handler("text"), cancels=[submit_event, stream_event, long_event])
                 
             
         with gr.Tab("Generate Music by melody"):
@@ -229,29 +325,31 @@ def UI(share=False):
                         visible=True)
                     with gr.Row():
                         duration2 = gr.Number(10, label="Duration", interactive=True)
-                        num_outputs2 = gr.Number(1, label="Number of outputs", interactive=True)
+                        num_outputs2 = gr.Number(1, label="Number of outputs", minimum=1, maximum=MAX_OUTPUTS, interactive=True)
+                        seed2 = gr.Number(-1, label="Seed", precision=0, info="-1 for random", interactive=True)
 
                     @gr.on(inputs=[duration2], outputs=config_output_textbox2)
                     def return_model_configs2(duration):
                         return {"duration": duration, "use_sampling": True, "top_k": 300, "top_p": 0, "temperature": 1}
                     submit2 = gr.Button("Generate Music")
-                    result_text2 = gr.Textbox(label="Generated Music (melody)", type="text", interactive=False, visible=True)
-                    submit2.click(
-                        fn=predict,
-                        inputs=[model_path2, config_output_textbox2, prompt_text2, upload_melody, num_outputs2],
+                    stop2 = gr.Button("Stop", variant="stop")
+                    result_text2 = gr.JSON(label="Generated Music (melody)")
+                    def predict_melody(model_version, generation_configs, prompt_text, prompt_wav, num_generations, seed,
+                                       request: gr.Request, progress=gr.Progress()):
+                        yield from predict(
+                            model_version, generation_configs, prompt_text, prompt_wav, num_generations, seed,
+                            request=request, progress=progress, cancel_group="melody",
+                        )
+
+                    submit2_event = submit2.click(
+                        fn=predict_melody,
+                        inputs=[model_path2, config_output_textbox2, prompt_text2, upload_melody, num_outputs2, seed2],
                         outputs=result_text2,
                         queue=True
                     )
+                    stop2.click(fn=cancel_handler("melody"), cancels=[submit2_event])
 
-                    @gr.render(inputs=result_text2)
-                    def show_output_audio(tmp_paths):
-                        if tmp_paths:
-                            tmp_paths = ast.literal_eval(tmp_paths)
-                            print(tmp_paths)
-                            for i in range(len(tmp_paths)):
-                                tmp_path = tmp_paths[i]
-                                _audio = gr.Audio(value=tmp_path , label=f"Generated Music {i}", type='filepath', interactive=False)
-                                output_audios.append(_audio)
+                    output_audios2 = output_slots(result_text2)
             gr.Examples(
                 examples = [
                     [
@@ -261,6 +359,7 @@ def UI(share=False):
                         30, 
                         "facebook/musicgen-large",
                         "Muisc Continuation",
+                        42,
                     ],
                     [
                         os.path.join(
@@ -269,9 +368,10 @@ def UI(share=False):
                         40, 
                         "facebook/musicgen-melody-large",
                         "Music Conditioning",
+                        42,
                     ]
                 ],
-                inputs=[upload_melody, duration2, model_path2, radio_melody_condition],
+                inputs=[upload_melody, duration2, model_path2, radio_melody_condition, seed2],
             )
 
         with gr.Tab("Generate Music by image"):
@@ -297,37 +397,40 @@ def UI(share=False):
                     value="facebook/musicgen-large",
                 )
                 duration3 = gr.Number(30, visible=False, label="Duration")
+                seed3 = gr.Number(-1, label="Seed", precision=0, info="-1 for random", interactive=True)
                 submit3 = gr.Button("Generate Music")
-                result_text3 = gr.Textbox(label="Generated Music (image)", type="text", interactive=False, visible=True)
-                def predict_image_music(model_path3, image_caption, duration3, melody3):
+                stop3 = gr.Button("Stop", variant="stop")
+                result_text3 = gr.JSON(label="Generated Music (image)")
+                def predict_image_music(model_path3, image_caption, duration3, melody3, seed3, request: gr.Request):
                     model_configs = {"duration": duration3, "use_sampling": True, "top_k": 250, "top_p": 0, "temperature": 1}
-                    return predict(
+                    yield from predict(
                         model_version = model_path3, 
                         generation_configs = model_configs, 
                         prompt_text = image_caption, 
-                        prompt_wav = melody3
+                        prompt_wav = melody3,
+                        seed = seed3,
+                        transcribe_midi = True,
+                        request = request,
+                        cancel_group = "image",
                         )
 
-                submit3.click(
+                midi_files = gr.File(label="MIDI transcriptions", file_count="multiple", interactive=False)
+                # transcription runs in the background from the moment clips are written,
+                # the MIDI files are collected once the audio is already shown
+                submit3_event = submit3.click(
                     fn=predict_image_music,
-                    inputs=[model_path3, image_caption, duration3, melody3],
+                    inputs=[model_path3, image_caption, duration3, melody3, seed3],
                     outputs=result_text3,
                     queue=True
                 )
+                transcription_event = submit3_event.then(
+                    fn=transcription_results,
+                    inputs=result_text3,
+                    outputs=midi_files,
+                )
+                stop3.click(fn=cancel_handler("image"), cancels=[submit3_event, transcription_event])
 
-                @gr.render(inputs=result_text3)
-                def show_output_audio(tmp_paths):
-                    if tmp_paths:
-                        tmp_paths = ast.literal_eval(tmp_paths)
-                        print(tmp_paths)
-                        for i in range(len(tmp_paths)):
-                            tmp_path = tmp_paths[i]
-                            _audio = gr.Audio(value=tmp_path , label=f"Generated Music {i}", type='filepath', interactive=False)
-                            output_audios.append(_audio)
-
-                @gr.render(inputs=result_text3)
-                def show_transcribt_audio(tmp_paths):
-                    transcribe(tmp_paths)
+                output_audios3 = output_slots(result_text3)
             gr.Examples(
                 examples = [
                     [
@@ -337,6 +440,7 @@ def UI(share=False):
                         "facebook/musicgen-large",
                         30,
                         None,
+                        42,
                     ],
                     [
                         os.path.join(
@@ -345,6 +449,7 @@ def UI(share=False):
                         "facebook/audiogen-medium",
                         15,
                         None,
+                        42,
                     ],
                     [
                         os.path.join(
@@ -355,6 +460,7 @@ def UI(share=False):
                         os.path.join(
                             os.path.dirname(__file__), "./data/audio/Suri's Improv.mp3"
                         ),
+                        42,
                     ],
                     [
                         os.path.join(
@@ -363,18 +469,87 @@ def UI(share=False):
                         "facebook/musicgen-large",
                         30,
                         None,
+                        42,
                     ],
                 ],
-                inputs=[image_input, model_path3, duration3, melody3],
+                inputs=[image_input, model_path3, duration3, melody3, seed3],
             )
 
-    demo.queue().launch(share=share)
+        # a closed tab stops its generations instead of running them to the end
+        demo.unload(cancel_requests)
+
+    print_startup_report()
+    if startup_report:
+        return
+    app, _, _ = demo.queue().launch(
+        share=share,
+        prevent_thread_lock=True,
+        # gradio only serves files from the temp directory and the working directory by default
+        allowed_paths=[str(artifact_store.root), str(audio_cache.root)],
+    )
+    add_health_routes(app)
+    demo.block_thread()
 
 
 if __name__ == "__main__":
     # Create the parser
     parser = argparse.ArgumentParser()
     parser.add_argument('--share', action='store_true', help='Enable sharing.')
+    parser.add_argument('--model-cache-gb', type=float, default=None,
+                        help='Memory budget for resident checkpoints, least recently used ones are evicted beyond it.')
+    parser.add_argument('--audio-cache-gb', type=float, default=None,
+                        help='Size cap of the on-disk cache of seeded generations.')
+    parser.add_argument('--artifact-quota-gb', type=float, default=None,
+                        help='Disk quota for the generated files served to the UI, the oldest ones are removed beyond it.')
+    parser.add_argument('--output-format', default=None, choices=OUTPUT_FORMATS,
+                        help='Format the generated clips are encoded to.')
+    parser.add_argument('--serve-from-disk', action='store_true',
+                        help='Write every generated clip to a file instead of serving it from memory.')
+    parser.add_argument('--precision', default=None, choices=PRECISIONS,
+                        help='Inference precision of every checkpoint on CPU, instead of its MODEL_PRECISION in model_cards.py.')
+    parser.add_argument('--compile', action='store_true',
+                        help='Generate under torch.inference_mode with a compiled LM forward, falling back to eager if compilation fails.')
+    parser.add_argument('--concurrency-limit', type=int, default=None,
+                        help='Number of requests per event processed at once, concurrent compatible text prompts are batched together '
+                             '(default: --max-batch-size, and at least --workers).')
+    parser.add_argument('--batch-window', type=float, default=0.05,
+                        help='Seconds to wait for compatible requests before starting a batched generation.')
+    parser.add_argument('--max-batch-size', type=int, default=16,
+                        help='Maximum number of outputs generated in a single batch.')
+    parser.add_argument('--prewarm', nargs='*', default=[], metavar='MODEL',
+                        help='Checkpoints to load and warm up in the background at startup, /readyz reports 503 until they are ready.')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Run generations in this many worker processes, each keeping its own checkpoints loaded. 0 generates in the server process.')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='Build the UI, print per-import startup timings and exit without serving.')
     args = parser.parse_args()
+    if args.model_cache_gb is not None:
+        model_registry.memory_budget = args.model_cache_gb * 1024 ** 3
+    if args.audio_cache_gb is not None:
+        audio_cache.max_bytes = args.audio_cache_gb * 1024 ** 3
+    if args.artifact_quota_gb is not None:
+        artifact_store.max_bytes = args.artifact_quota_gb * 1024 ** 3
+    if args.precision is not None:
+        # read at load time, also by the worker processes
+        os.environ["MODEL_PRECISION"] = args.precision
+    if args.compile:
+        compiled_lm.enabled = True
+    if args.output_format is not None:
+        clip_store.output_format = args.output_format
+    if args.serve_from_disk:
+        clip_store.in_memory = False
+    batch_scheduler.window = args.batch_window
+    batch_scheduler.max_batch_size = args.max_batch_size
 
-    UI(share=args.share)
+    if not args.startup_report:
+        if args.workers > 0:
+            # the checkpoints to prewarm are spread across the workers
+            start_workers(args.workers, args.prewarm)
+        else:
+            prewarmer.start(args.prewarm)
+    concurrency_limit = args.concurrency_limit
+    if concurrency_limit is None:
+        # requests only meet in the batch scheduler if gradio runs them at the same time,
+        # generation itself is serialized per model by the model lock
+        concurrency_limit = max(args.max_batch_size, args.workers, 1)
+    UI(share=args.share, concurrency_limit=concurrency_limit, startup_report=args.startup_report)
@@ -0,0 +1,25 @@
+import argparse
+
+from gradio_components.batch_jobs import load_jobs, run_jobs
+from gradio_components.outputs import OUTPUT_FORMATS
+from gradio_components.prediction import clip_store, model_registry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a JSONL file of generation jobs without the UI.")
+    parser.add_argument('jobs', help='JSONL file, one {"model", "prompt", "config", "melody", "n", "seed"} job per line.')
+    parser.add_argument('--output-dir', default='outputs', help='Directory the outputs and the manifest are written to.')
+    parser.add_argument('--manifest', default=None,
+                        help='Manifest of finished jobs, skipped when rerunning (default OUTPUT_DIR/manifest.jsonl).')
+    parser.add_argument('--max-batch-size', type=int, default=16,
+                        help='Maximum number of outputs generated in a single batch.')
+    parser.add_argument('--model-cache-gb', type=float, default=None,
+                        help='Memory budget for resident checkpoints, least recently used ones are evicted beyond it.')
+    parser.add_argument('--output-format', default='wav', choices=OUTPUT_FORMATS, help='Format the outputs are encoded to.')
+    args = parser.parse_args()
+    clip_store.output_format = args.output_format
+    if args.model_cache_gb is not None:
+        model_registry.memory_budget = args.model_cache_gb * 1024 ** 3
+
+    manifest = run_jobs(load_jobs(args.jobs), args.output_dir, args.manifest, args.max_batch_size)
+    print(f"{len(manifest.done)} jobs done, manifest at {manifest.path}")
@@ -0,0 +1,250 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import time
+import typing as tp
+from concurrent.futures import ProcessPoolExecutor
+
+from gradio_components.model_cards import (
+    MELODY_CONDITIONED_MODELS,
+    MELODY_CONTINUATION_MODELS,
+    TEXT_TO_MUSIC_MODELS,
+    TEXT_TO_SOUND_MODELS,
+)
+from gradio_components.precision import PRECISIONS
+
+# task -> checkpoints, as offered by the UI
+TASKS = {
+    "text-to-music": TEXT_TO_MUSIC_MODELS,
+    "text-to-sound": TEXT_TO_SOUND_MODELS,
+    "melody-conditioned": MELODY_CONDITIONED_MODELS,
+    "melody-continuation": MELODY_CONTINUATION_MODELS,
+}
+PROMPT = "lofi hip hop beat with a warm piano melody"
+MELODY = os.path.join(os.path.dirname(__file__), "data", "audio", "twinkle_twinkle_little_stars_mozart_20sec.mp3")
+
+
+def default_models(models: tp.Sequence[str]) -> tp.List[str]:
+    """The small checkpoints of a task, or its first one that is neither medium nor large."""
+    small = [m for m in models if "small" in m]
+    if small:
+        return small
+    return [m for m in models if "medium" not in m and "large" not in m][:1]
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+def _peak_rss_mb() -> float:
+    # kilobytes on Linux, the peak of the whole process: each checkpoint runs in its own, see `_isolated`
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _environment() -> dict:
+    import torch
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(__file__) or "."
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    try:
+        from importlib.metadata import version
+        audiocraft_version = version("audiocraft")
+    except Exception:
+        audiocraft_version = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "audiocraft": audiocraft_version,
+        "cuda": torch.cuda.is_available(),
+    }
+
+
+def mel_distance_db(a, b, sample_rate) -> float:
+    """Mean per-frame distance, in dB, between the log-mel spectrograms of two [C, T] clips:
+    the RMS over mel bands of the difference of each frame, averaged over frames. 0 is identical.
+
+    Frames are compared in order, so the clips have to be generated greedily (see `_generate`)
+    for the distance to measure the precision rather than the sampling.
+    """
+    import torch
+    import torchaudio
+    mel = torchaudio.transforms.MelSpectrogram(sample_rate, n_fft=2048, hop_length=512, n_mels=64)
+    to_db = torchaudio.transforms.AmplitudeToDB(top_db=80)
+    length = min(a.shape[-1], b.shape[-1])
+    # [n_mels, frames]
+    specs = [to_db(mel(clip[..., :length].mean(0))) for clip in (a, b)]
+    return float((specs[0] - specs[1]).pow(2).mean(0).sqrt().mean())
+
+
+def _generate(model_version, model, task, num_outputs, duration, seed, greedy=False):
+    import torch
+    from gradio_components.prediction import _MODEL_INFERENCES, process_audio
+    configs = {} if "magnet" in model_version else {"duration": duration}
+    if greedy:
+        configs["use_sampling"] = False
+    torch.manual_seed(seed)
+    if task == "melody-conditioned":
+        melody, sr = process_audio(MELODY, duration, model)
+        outputs = _MODEL_INFERENCES[model_version](model, configs, PROMPT, melody, sr, num_outputs)
+    elif task == "melody-continuation":
+        # the output includes the prompt, half of the clip is continued
+        melody, sr = process_audio(MELODY, duration / 2, model)
+        outputs = _MODEL_INFERENCES["musicgen-continuation"](model, configs, PROMPT, melody, sr, num_outputs)
+    else:
+        outputs = _MODEL_INFERENCES[model_version](model, configs, [PROMPT] * num_outputs)
+    return outputs.detach().cpu().float()
+
+
+def _run(model_version, model, task, num_outputs, duration, seed):
+    be = time.perf_counter()
+    outputs = _generate(model_version, model, task, num_outputs, duration, seed)
+    wall = time.perf_counter() - be
+    prompt_seconds = 0.0
+    if task == "melody-continuation":
+        # the outputs start with the prompt, which is not generated (decoded prompts are cached)
+        from gradio_components.prediction import process_audio
+        melody, sr = process_audio(MELODY, duration / 2, model)
+        prompt_seconds = melody.shape[-1] / sr
+    audio_seconds = outputs.shape[0] * (outputs.shape[-1] / model.sample_rate - prompt_seconds)
+    return {
+        "num_outputs": num_outputs,
+        "wall_seconds": round(wall, 3),
+        # generated seconds, over the whole batch
+        "audio_seconds": round(audio_seconds, 3),
+        "prompt_seconds": round(prompt_seconds, 3),
+        # seconds of audio per wall second, over the whole batch
+        "real_time_factor": round(audio_seconds / wall, 4),
+    }
+
+
+def _compare(result, sample, reference, reference_sample, sample_rate) -> dict:
+    """Gains of `result` over the fp32 `reference` run of the same checkpoint and task."""
+    reference_rtf = {run["num_outputs"]: run["real_time_factor"] for run in reference["runs"]}
+    return {
+        # > 1 is faster than fp32
+        "real_time_factor_gain": {
+            str(run["num_outputs"]): round(run["real_time_factor"] / reference_rtf[run["num_outputs"]], 3)
+            for run in result["runs"] if reference_rtf.get(run["num_outputs"])
+        },
+        "model_memory_reduction": round(1 - result["model_mb"] / reference["model_mb"], 3),
+        "mel_distance_db": round(mel_distance_db(sample, reference_sample, sample_rate), 3),
+    }
+
+
+def benchmark_model(model_version, task, batch_sizes, duration, seed, precision="fp32", reference=None):
+    """Benchmark `model_version` at `precision`, returning its result and a clip generated with
+    `seed`. `reference` is the result and clip of the fp32 run, to compare to.
+
+    Meant to run in a fresh process (see `_isolated`): the load is cold and the peak memory is
+    this checkpoint's only.
+    """
+    # read when the checkpoint is loaded
+    os.environ["MODEL_PRECISION"] = precision
+    from gradio_components.prediction import model_registry, load_model
+    result: tp.Dict[str, tp.Any] = {"model": model_version, "task": task, "precision": precision}
+    sample = None
+    try:
+        result["rss_before_load_mb"] = round(_rss_mb(), 1)
+        be = time.perf_counter()
+        model = load_model(model_version)
+        result["load_seconds"] = round(time.perf_counter() - be, 3)
+        result["rss_after_load_mb"] = round(_rss_mb(), 1)
+        result["model_mb"] = round(model_registry.sizes[model_version] / 1024 ** 2, 1)
+        model.set_custom_progress_callback(lambda generated, to_generate: None)
+        # first-call warmup, not reported
+        _run(model_version, model, task, 1, min(duration, 1), seed)
+        # continuation is not batched, see inference_musicgen_continuation
+        sizes = [1] if task == "melody-continuation" else batch_sizes
+        result["runs"] = [_run(model_version, model, task, n, duration, seed) for n in sizes]
+        result["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        # greedy, so that the clips of two precisions only differ by the precision
+        sample = _generate(model_version, model, task, 1, duration, seed, greedy=True)[0]
+        if reference is not None and reference[1] is not None:
+            result["vs_fp32"] = _compare(result, sample, reference[0], reference[1], model.sample_rate)
+        print(json.dumps(result))
+    except Exception as e:
+        print(f"Error while benchmarking {model_version} ({task}, {precision}): {e}")
+        result["error"] = str(e)
+    return result, sample
+
+
+def _isolated(model_version, task, batch_sizes, duration, seed, precision, reference):
+    """`benchmark_model` in a new process, so `peak_rss_mb` does not carry over the previous checkpoints."""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        try:
+            return executor.submit(
+                benchmark_model, model_version, task, batch_sizes, duration, seed, precision, reference
+            ).result()
+        except Exception as e:
+            # e.g. killed when out of memory
+            print(f"Error while benchmarking {model_version} ({task}, {precision}): {e}")
+            return {"model": model_version, "task": task, "precision": precision, "error": str(e)}, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the checkpoints of gradio_components/model_cards.py.")
+    parser.add_argument('--output', default='benchmark.json', help='JSON file the results are written to.')
+    parser.add_argument('--tasks', nargs='*', default=list(TASKS), choices=list(TASKS), help='Tasks to benchmark.')
+    parser.add_argument('--models', nargs='*', default=None,
+                        help='Checkpoints to benchmark (default: the small checkpoint of each task).')
+    parser.add_argument('--all-models', action='store_true', help='Benchmark every checkpoint of each task.')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds of audio per output (MAGNeT ignores it).')
+    parser.add_argument('--batch-sizes', type=int, nargs='*', default=list(range(1, 11)),
+                        help='Values of num_outputs to measure the batch scaling with.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--device', default='cpu', choices=['cpu', 'cuda'])
+    parser.add_argument('--precisions', nargs='*', default=['fp32'], choices=PRECISIONS,
+                        help='Inference precisions to benchmark each checkpoint at, compared to fp32 when it is included.')
+    args = parser.parse_args()
+    if args.device == 'cpu':
+        # audiocraft picks cuda whenever it is available
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    results = []
+    for task in args.tasks:
+        models = TASKS[task] if args.all_models else default_models(TASKS[task])
+        if args.models is not None:
+            models = [m for m in TASKS[task] if m in args.models]
+        for model_version in models:
+            reference = None
+            # fp32 first, the other precisions are compared to it
+            for precision in sorted(set(args.precisions), key=PRECISIONS.index):
+                result, sample = _isolated(
+                    model_version, task, args.batch_sizes, args.duration, args.seed, precision, reference
+                )
+                if precision == "fp32" and "error" not in result:
+                    reference = (result, sample)
+                results.append(result)
+
+    report = {
+        "environment": _environment(),
+        "config": {
+            "duration": args.duration,
+            "batch_sizes": args.batch_sizes,
+            "seed": args.seed,
+            "device": args.device,
+            "precisions": args.precisions,
+            "prompt": PROMPT,
+            "melody": os.path.basename(MELODY),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print("benchmark written to", args.output)
@@ -0,0 +1,157 @@
+import atexit
+import os
+import shutil
+import threading
+import time
+import typing as tp
+from collections import Counter, deque
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ArtifactStore:
+    """Lifecycle of the files handed to the UI: generated clips, MIDI transcriptions, long-form tracks.
+
+    Each process writes to its own `root/<pid>` directory, indexed in creation order. A
+    background thread removes files older than `file_lifetime` seconds and, once the
+    directory grows over `max_bytes`, the oldest files first. Pinned files (being written,
+    or waiting for transcription) are skipped by both. The directory is removed on exit,
+    and directories left behind by processes that crashed, including a previous process
+    with the same pid, are removed at startup.
+    """
+    def __init__(self, root: tp.Union[str, Path], file_lifetime: float = 3600, max_bytes: float = 4 * 1024 ** 3,
+                 sweep_interval: float = 30):
+        self.root = Path(root)
+        self.dir = self.root / str(os.getpid())
+        self.file_lifetime = file_lifetime
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        # (time added, path), oldest first
+        self._index: tp.Deque[tp.Tuple[float, Path]] = deque()
+        self._sizes: tp.Dict[Path, int] = {}
+        self._bytes = 0
+        self._pins: tp.Counter[Path] = Counter()
+        self._lock = threading.Lock()
+        self._thread: tp.Optional[threading.Thread] = None
+
+    def _start(self):
+        # on first use, so that importing the module does not touch the disk
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._recover()
+            # left by an earlier process with the same pid (a restarted container often gets
+            # the pid it had before the crash), this process has not written anything yet
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir.mkdir(parents=True, exist_ok=True)
+            atexit.register(self.close)
+            self._thread = threading.Thread(target=self._run, name="artifact-sweeper", daemon=True)
+            self._thread.start()
+
+    def _recover(self):
+        if not self.root.exists():
+            return
+        for entry in self.root.iterdir():
+            if entry.is_dir() and entry.name.isdigit() and not _pid_alive(int(entry.name)):
+                print("Removing orphaned artifacts", entry)
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def new_file(self, suffix: str = "") -> str:
+        """Path of a new empty file in the store, already registered."""
+        self._start()
+        with NamedTemporaryFile("wb", suffix=suffix, dir=self.dir, delete=False) as file:
+            path = file.name
+        self.add(path)
+        return path
+
+    def add(self, path: tp.Union[str, Path]):
+        """Track `path` for cleanup, whether it was written in the store or elsewhere."""
+        self._start()
+        path = Path(path)
+        size = path.stat().st_size if path.exists() else 0
+        with self._lock:
+            if path in self._sizes:
+                # re-added once written, only the size changes
+                self._bytes += size - self._sizes[path]
+                self._sizes[path] = size
+                return
+            self._index.append((time.time(), path))
+            self._sizes[path] = size
+            self._bytes += size
+
+    def discard(self, path: tp.Union[str, Path]):
+        """Stop tracking `path`, e.g. once it was moved to the audio cache."""
+        with self._lock:
+            self._bytes -= self._sizes.pop(Path(path), 0)
+
+    def pin(self, path: tp.Union[str, Path]):
+        with self._lock:
+            self._pins[Path(path)] += 1
+
+    def unpin(self, path: tp.Union[str, Path]):
+        with self._lock:
+            self._pins[Path(path)] -= 1
+            if self._pins[Path(path)] <= 0:
+                del self._pins[Path(path)]
+
+    @contextmanager
+    def pinned(self, path: tp.Union[str, Path]):
+        self.pin(path)
+        try:
+            yield str(path)
+        finally:
+            self.unpin(path)
+            # the size is known once the file is written
+            self.add(path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error while sweeping artifacts: {e}")
+
+    def sweep(self):
+        """Remove expired files, then the oldest ones while over quota. Stops at the first file
+        to keep for each, so a sweep only visits what it removes (and the pinned files)."""
+        now = time.time()
+        removed = []
+        with self._lock:
+            kept = []
+            while self._index:
+                time_added, path = self._index[0]
+                expired = now - time_added > self.file_lifetime
+                if not expired and self._bytes <= self.max_bytes:
+                    break
+                self._index.popleft()
+                if path not in self._sizes:
+                    # discarded
+                    continue
+                if self._pins[path] > 0:
+                    kept.append((time_added, path))
+                    continue
+                self._bytes -= self._sizes.pop(path)
+                removed.append(path)
+            self._index.extendleft(reversed(kept))
+        for path in removed:
+            path.unlink(missing_ok=True)
+        if removed:
+            print(f"Removed {len(removed)} artifacts", self.stats())
+
+    def stats(self) -> dict:
+        return {"files": len(self._sizes), "bytes": self._bytes, "pinned": len(self._pins)}
+
+    def close(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import typing as tp
+from collections import OrderedDict
+from pathlib import Path
+
+
+class AudioCache:
+    """On-disk cache of generated clips, addressed by a hash of everything that determines
+    the output: model, prompt, generation configs, melody prompt content and seed.
+
+    Entries live in their own directory (not tracked by the `ArtifactStore`) and are evicted least
+    recently used first once the cache grows over `max_bytes`. Entries served in the last
+    `grace_period` seconds are never evicted, so the paths handed to the UI stay valid
+    while the browser fetches them.
+    """
+    def __init__(self, root: tp.Union[str, Path], max_bytes: float = 2 * 1024 ** 3, grace_period: float = 300):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.grace_period = grace_period
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (size in bytes, last access time), least recently used first
+        self._entries: tp.OrderedDict[str, tp.Tuple[int, float]] = OrderedDict()
+        self._load_index()
+
+    def _load_index(self):
+        if not self.root.exists():
+            return
+        entries = []
+        for entry in self.root.iterdir():
+            files = sorted(entry.glob("[0-9][0-9].*")) if entry.is_dir() else []
+            if not files:
+                continue
+            size = sum(f.stat().st_size for f in files)
+            entries.append((entry.stat().st_mtime, entry.name, size))
+        for mtime, key, size in sorted(entries):
+            self._entries[key] = (size, mtime)
+
+    @staticmethod
+    def key(model_version, text, configs, melody_hash, seed, num_outputs, output_format="wav",
+            precision="fp32") -> str:
+        payload = [model_version, text, configs, melody_hash, seed, int(num_outputs)]
+        if output_format != "wav":
+            # keeps the keys of the entries cached before compressed formats existed
+            payload.append(output_format)
+        if precision != "fp32":
+            # a seed does not give the same audio at another precision
+            payload.append(precision)
+        payload = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> tp.Optional[tp.List[str]]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            files = sorted((self.root / key).glob("[0-9][0-9].*"))
+            if not files:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touch(key)
+            return [str(f) for f in files]
+
+    def meta(self, key: str) -> dict:
+        """Metadata stored with the clips of `key` by `put`, empty for entries cached without it."""
+        try:
+            with open(self.root / key / "meta.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def put(self, key: str, paths: tp.List[str], meta: tp.Optional[dict] = None) -> tp.List[str]:
+        """Move freshly generated clips into the cache, with their JSON `meta`data if given,
+        and return their cached paths."""
+        entry = self.root / key
+        entry.mkdir(parents=True, exist_ok=True)
+        if meta is not None:
+            with open(entry / "meta.json", "w") as f:
+                json.dump(meta, f)
+        cached = []
+        for i, path in enumerate(paths):
+            target = entry / f"{i:02d}{Path(path).suffix}"
+            shutil.move(str(path), target)
+            cached.append(str(target))
+        size = sum(Path(p).stat().st_size for p in cached)
+        with self._lock:
+            self._entries[key] = (size, time.time())
+            self._touch(key)
+            self._evict()
+        return cached
+
+    def _touch(self, key: str):
+        size, _ = self._entries[key]
+        now = time.time()
+        self._entries[key] = (size, now)
+        self._entries.move_to_end(key)
+        os.utime(self.root / key, (now, now))
+
+    def _evict(self):
+        total = sum(size for size, _ in self._entries.values())
+        now = time.time()
+        for key, (size, last_access) in list(self._entries.items()):
+            if total <= self.max_bytes:
+                break
+            if now - last_access < self.grace_period:
+                # everything after this one was used even more recently
+                break
+            shutil.rmtree(self.root / key, ignore_errors=True)
+            del self._entries[key]
+            total -= size
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "size_gb": round(sum(size for size, _ in self._entries.values()) / 1024 ** 3, 3),
+        }
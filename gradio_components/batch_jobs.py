@@ -0,0 +1,152 @@
+import hashlib
+import itertools
+import json
+import os
+import time
+import typing as tp
+from pathlib import Path
+
+from gradio_components.prediction import (
+    _MODEL_INFERENCES,
+    _encode_output,
+    clip_store,
+    encode_pool,
+    load_model,
+    model_registry,
+    process_audio,
+)
+
+
+def load_jobs(path: tp.Union[str, Path]) -> tp.List[dict]:
+    """Jobs of a JSONL file, one `{"model", "prompt", "config", "melody", "n", "seed"}` object per
+    line. Only `model` is required, `id` defaults to a hash of the job so reruns find it again."""
+    jobs = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            if "model" not in job:
+                raise ValueError(f"{path}:{line_number}: job has no model")
+            job.setdefault("prompt", None)
+            job.setdefault("config", {})
+            job.setdefault("melody", None)
+            job.setdefault("n", 1)
+            job.setdefault("seed", None)
+            job.setdefault("id", hashlib.sha256(json.dumps(job, sort_keys=True).encode()).hexdigest()[:16])
+            jobs.append(job)
+    return jobs
+
+
+class Manifest:
+    """Append-only JSONL record of finished jobs and their output files.
+
+    Every line is flushed to disk once the outputs of its job are written, so after a crash
+    the jobs recorded here (whose files still exist) are skipped by the next run.
+    """
+    def __init__(self, path: tp.Union[str, Path]):
+        self.path = Path(path)
+        self.done: tp.Dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a line cut short by the crash
+                        continue
+                    if all(Path(output).exists() for output in entry["outputs"]):
+                        self.done[entry["id"]] = entry
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self.done
+
+    def add(self, job: dict, outputs: tp.List[str], elapsed: float):
+        entry = {"id": job["id"], "job": job, "outputs": outputs, "elapsed": round(elapsed, 3)}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done[job["id"]] = entry
+
+
+def _batch_key(job: dict):
+    # jobs sharing a key go through a single `generate` call
+    return job["model"], json.dumps(job["config"], sort_keys=True)
+
+
+def _batchable(job: dict) -> bool:
+    # seeded outputs depend on the batch content, melody prompts have their own inference path
+    return job["melody"] is None and job["seed"] is None
+
+
+def plan_batches(jobs: tp.Sequence[dict], max_batch_size: int = 16) -> tp.List[tp.List[dict]]:
+    """Order jobs by model, so each checkpoint is loaded once, and group compatible text jobs
+    into batches of at most `max_batch_size` outputs."""
+    batches = []
+    for _, group in itertools.groupby(sorted(jobs, key=_batch_key), key=_batch_key):
+        batch: tp.List[dict] = []
+        for job in group:
+            if not _batchable(job):
+                batches.append([job])
+                continue
+            if batch and sum(int(j["n"]) for j in batch) + int(job["n"]) > max_batch_size:
+                batches.append(batch)
+                batch = []
+            batch.append(job)
+        if batch:
+            batches.append(batch)
+    return batches
+
+
+def _generate(model_version: str, model, jobs: tp.List[dict]):
+    import torch
+    job = jobs[0]
+    configs = job["config"]
+    with model_registry.model_lock(model_version):
+        model.set_custom_progress_callback(None)
+        if job["seed"] is not None:
+            torch.manual_seed(int(job["seed"]))
+        if job["melody"] is not None:
+            duration = configs.get("duration", model.max_duration)
+            melody, sr = process_audio(job["melody"], duration, model)
+            if "melody" in model_version:
+                inference_func = _MODEL_INFERENCES[model_version]
+            else:
+                inference_func = _MODEL_INFERENCES["musicgen-continuation"]
+            return inference_func(model, configs, job["prompt"], melody, sr, int(job["n"]))
+        descriptions = [j["prompt"] for j in jobs for _ in range(int(j["n"]))]
+        return _MODEL_INFERENCES[model_version](model, configs, descriptions)
+
+
+def run_jobs(jobs: tp.Sequence[dict], output_dir: tp.Union[str, Path], manifest_path=None, max_batch_size: int = 16):
+    """Generate every job not yet in the manifest, writing `output_dir/<job id>/NN.<output format>`."""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(manifest_path or output_dir / "manifest.jsonl")
+    pending = [job for job in jobs if job["id"] not in manifest]
+    print(f"{len(jobs) - len(pending)} jobs already done, {len(pending)} to run")
+    batches = plan_batches(pending, max_batch_size)
+    for i, batch in enumerate(batches):
+        model_version = batch[0]["model"]
+        be = time.time()
+        model = load_model(model_version)
+        outputs = _generate(model_version, model, batch).detach().cpu().float()
+        elapsed = time.time() - be
+        print(f"batch {i + 1}/{len(batches)}: {len(outputs)} outputs of {model_version} in {elapsed:.2f}s")
+        offset = 0
+        for job in batch:
+            # a melody job is alone in its batch, and continuation yields a single output whatever `n`
+            job_outputs = outputs if len(batch) == 1 else outputs[offset:offset + int(job["n"])]
+            offset += len(job_outputs)
+            job_dir = output_dir / job["id"]
+            job_dir.mkdir(exist_ok=True)
+            paths = [str(job_dir / f"{k:02d}.{clip_store.output_format}") for k in range(len(job_outputs))]
+            futures = [
+                encode_pool.submit(_encode_output, output, model.sample_rate, path, model_version, clip_store.output_format)
+                for output, path in zip(job_outputs, paths)
+            ]
+            for future in futures:
+                future.result()
+            manifest.add(job, paths, elapsed * len(job_outputs) / len(outputs))
+    return manifest
@@ -0,0 +1,154 @@
+import contextvars
+import threading
+import time
+import typing as tp
+from collections import defaultdict
+from concurrent.futures import Future
+
+from gradio_components.cancellation import Cancelled
+
+
+class _BatchRequest:
+    def __init__(self, text: str, num_outputs: int, progress_callback=None):
+        self.text = text
+        self.num_outputs = int(num_outputs)
+        self.progress_callback = progress_callback
+        # the callback runs on the leader's thread, in the context of the caller: gr.Progress
+        # finds the event it reports to through context variables
+        self.context = contextvars.copy_context()
+        self.future: Future = Future()
+        self.promoted = False
+        self.leading = False
+
+
+def _config_key(configs: dict) -> tuple:
+    return tuple(sorted(configs.items()))
+
+
+class BatchScheduler:
+    """Groups concurrent text-only generations that target the same checkpoint with the
+    same generation params, and runs them as one batched `model.generate` call.
+
+    The first request of a group becomes its leader: it waits `window` seconds and for the
+    checkpoint lock, then takes every compatible request queued in the meantime (up to
+    `max_batch_size` descriptions), generates them together and hands each caller its slice.
+
+    A cancelled request leaves the queue right away, handing over the leadership if it had it.
+    Once its batch is running, it stops receiving progress and the batch is aborted when all
+    of its requests are cancelled.
+    """
+    def __init__(self, lock_for: tp.Callable[[str], tp.Any], window: float = 0.05, max_batch_size: int = 16):
+        self.lock_for = lock_for
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: tp.Dict[tuple, tp.List[_BatchRequest]] = defaultdict(list)
+        self._leaders: tp.Set[tuple] = set()
+        self._cond = threading.Condition()
+
+    def generate(self, model_version, model, inference_func, configs, text, num_outputs=1,
+                 progress_callback=None, cancel_token=None):
+        key = (model_version, _config_key(configs))
+        request = _BatchRequest(text, num_outputs, progress_callback)
+        request.future.add_done_callback(self._notify)
+        with self._cond:
+            self._pending[key].append(request)
+            lead = key not in self._leaders
+            if lead:
+                self._leaders.add(key)
+                request.leading = True
+            if cancel_token is not None:
+                cancel_token.add_callback(lambda: self._cancel(key, request))
+            if not lead:
+                self._cond.wait_for(lambda: request.future.done() or request.promoted)
+                lead = not request.future.done()
+                request.leading = lead
+        if lead and not request.future.done():
+            self._lead(key, request, model_version, model, inference_func, configs)
+        return request.future.result()
+
+    def _notify(self, _future):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _cancel(self, key, request: _BatchRequest):
+        with self._cond:
+            pending = self._pending.get(key, [])
+            if request in pending:
+                pending.remove(request)
+                if request.leading or request.promoted:
+                    if pending:
+                        pending[0].promoted = True
+                    else:
+                        del self._pending[key]
+                        self._leaders.discard(key)
+            if not request.future.done():
+                request.future.set_exception(Cancelled())
+
+    def _take_batch(self, key) -> tp.List[_BatchRequest]:
+        with self._cond:
+            pending = self._pending[key]
+            batch, size = [], 0
+            while pending and (not batch or size + pending[0].num_outputs <= self.max_batch_size):
+                request = pending.pop(0)
+                batch.append(request)
+                size += request.num_outputs
+            if pending:
+                # hand the leadership of the rest of the queue to the oldest waiting request
+                pending[0].promoted = True
+                self._cond.notify_all()
+            else:
+                del self._pending[key]
+                self._leaders.discard(key)
+            return batch
+
+    def _resolve(self, request: _BatchRequest, result=None, exception=None):
+        # a request may have been cancelled meanwhile, its future is already done then
+        with self._cond:
+            if request.future.done():
+                return
+            if exception is not None:
+                request.future.set_exception(exception)
+            else:
+                request.future.set_result(result)
+
+    def _lead(self, key, leader, model_version, model, inference_func, configs):
+        time.sleep(self.window)
+        lock = self.lock_for(model_version)
+        while not lock.acquire(timeout=0.1):
+            if leader.future.done():
+                # cancelled while waiting, the leadership went to the next request
+                return
+        try:
+            if leader.future.done():
+                return
+            batch = self._take_batch(key)
+            if not batch:
+                return
+            descriptions = [request.text for request in batch for _ in range(request.num_outputs)]
+
+            def _progress(generated, to_generate):
+                active = [request for request in batch if not request.future.done()]
+                if not active:
+                    # every request of the batch was cancelled, stop generating
+                    raise Cancelled()
+                for request in active:
+                    if request.progress_callback is not None:
+                        try:
+                            request.context.run(request.progress_callback, generated, to_generate)
+                        except Cancelled as e:
+                            self._resolve(request, exception=e)
+
+            print("batched generation", model_version, len(batch), "requests", len(descriptions), "outputs")
+            model.set_custom_progress_callback(_progress)
+            try:
+                outputs = inference_func(model, configs, descriptions)
+            except BaseException as e:
+                for request in batch:
+                    self._resolve(request, exception=e)
+                return
+        finally:
+            lock.release()
+        offset = 0
+        for request in batch:
+            self._resolve(request, outputs[offset:offset + request.num_outputs])
+            offset += request.num_outputs
@@ -0,0 +1,77 @@
+import threading
+import typing as tp
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Cancelled(Exception):
+    """Raised in a generation whose request was cancelled."""
+
+
+class CancelToken:
+    """Cancellation flag of one request, checked by its progress callbacks during generation.
+
+    Callbacks added with `add_callback` run once when the token is cancelled, e.g. to drop
+    the request from a queue it is waiting in.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: tp.List[tp.Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: tp.Callable[[], None]):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+
+class CancelRegistry:
+    """Tokens of the requests in flight, by gradio session and group (e.g. the tab that started
+    them), so that a stop button cancels the requests of its own session and group only, and a
+    disconnect every request of its session."""
+    def __init__(self):
+        self._tokens: tp.Dict[tp.Tuple[tp.Optional[str], str], tp.Set[CancelToken]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self, session: tp.Optional[str], group: str = "default"):
+        key = (session, group)
+        token = CancelToken()
+        with self._lock:
+            self._tokens[key].add(token)
+        try:
+            yield token
+        finally:
+            with self._lock:
+                self._tokens[key].discard(token)
+                if not self._tokens[key]:
+                    del self._tokens[key]
+
+    def cancel(self, session: tp.Optional[str], groups: tp.Optional[tp.Iterable[str]] = None) -> int:
+        """Cancel the requests in flight of `session` in `groups` (all of them if None),
+        returning how many there were."""
+        with self._lock:
+            keys = [key for key in self._tokens if key[0] == session and (groups is None or key[1] in groups)]
+            tokens = [token for key in keys for token in self._tokens.pop(key)]
+        for token in tokens:
+            token.cancel()
+        return len(tokens)
@@ -0,0 +1,95 @@
+import threading
+import typing as tp
+
+from gradio_components.cancellation import Cancelled
+from gradio_components.startup import timed_import
+
+
+class CompiledLMCache:
+    """Opt-in fast path: token generation runs under `torch.inference_mode`, with the LM forward,
+    the step of the decode loop, compiled by `torch.compile`.
+
+    The forward is compiled once per LM class. Dynamo keeps the graphs it builds for the shapes
+    it meets (batch size, sequence length, each model's weights) in its own guard cache, so only
+    the first request of a shape pays the compilation. A model whose compiled run fails is
+    generated eagerly from then on.
+    """
+    def __init__(self, enabled: bool = False, mode: str = "default", cache_size_limit: int = 64):
+        self.enabled = enabled
+        self.mode = mode
+        self.cache_size_limit = cache_size_limit
+        self.compiles = 0
+        self.fallbacks = 0
+        self._compiled: tp.Dict[type, tp.Callable] = {}
+        self._failed: tp.Set[str] = set()
+        self._lock = threading.Lock()
+        self._configured = False
+
+    def _configure(self, torch):
+        if self._configured:
+            return
+        self._configured = True
+        # graphs per compiled function, beyond it dynamo runs new shapes eagerly (the default is 8)
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, self.cache_size_limit)
+        # keeps the compiled kernels on disk across restarts, where this torch supports it
+        if hasattr(torch._inductor.config, "fx_graph_cache"):
+            torch._inductor.config.fx_graph_cache = True
+
+    def _forward(self, model, version: str) -> tp.Optional[tp.Callable]:
+        torch = timed_import("torch")
+        with self._lock:
+            if version in self._failed:
+                return None
+            cls = type(model.lm)
+            forward = self._compiled.get(cls)
+            if forward is None:
+                self._configure(torch)
+                # the function of the class, not the bound method, so it does not keep evicted models alive
+                forward = torch.compile(cls.forward, mode=self.mode)
+                self.compiles += 1
+                self._compiled[cls] = forward
+                print("Compiling the forward of", cls.__name__, "for", version)
+            return forward
+
+    def _fail(self, version: str):
+        with self._lock:
+            self.fallbacks += 1
+            self._failed.add(version)
+
+    def install(self, model, version: str):
+        """Route the token generation of `model` through the fast path, while `enabled`."""
+        if getattr(model, "_compiled_lm", False):
+            return
+        generate_tokens = model._generate_tokens
+
+        def _generate_tokens(attributes, prompt_tokens, *args, **kwargs):
+            if not self.enabled:
+                return generate_tokens(attributes, prompt_tokens, *args, **kwargs)
+            torch = timed_import("torch")
+            forward = self._forward(model, version)
+            with torch.inference_mode():
+                if forward is None:
+                    return generate_tokens(attributes, prompt_tokens, *args, **kwargs)
+                lm = model.lm
+                lm.forward = lambda *a, **k: forward(lm, *a, **k)
+                try:
+                    return generate_tokens(attributes, prompt_tokens, *args, **kwargs)
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    print(f"Compiled generation failed for {version}, generating eagerly: {e}")
+                    self._fail(version)
+                finally:
+                    # back to the method of the class
+                    del lm.forward
+                return generate_tokens(attributes, prompt_tokens, *args, **kwargs)
+
+        model._generate_tokens = _generate_tokens
+        model._compiled_lm = True
+
+    def stats(self) -> dict:
+        return {
+            "compiles": self.compiles,
+            "fallbacks": self.fallbacks,
+            "eager": len(self._failed),
+        }
@@ -0,0 +1,124 @@
+import hashlib
+import os
+
+from gradio_components import metrics
+from gradio_components.utils import LRUCache
+
+
+def _tensor_bytes(tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+def hash_tensor(tensor) -> str:
+    return hashlib.sha256(tensor.detach().cpu().contiguous().numpy().tobytes()).hexdigest()
+
+
+def _precision(model) -> str:
+    # set on checkpoints loaded at a reduced precision, see prediction._load_reduced_precision
+    return getattr(model, "precision", "fp32")
+
+
+# chroma of melody prompts, keyed by (model, precision, melody content hash, sample rate, melody length)
+chroma_cache = LRUCache(
+    max_size=float(os.getenv("CHROMA_CACHE_MB", 256)) * 1024 ** 2, size_of=_tensor_bytes
+)
+
+
+def enable_chroma_cache(model):
+    """
+    Memoize the melody conditioner of a musicgen-melody model, so the demucs stem separation
+    and chromagram of a reference melody are computed once and reused by later generations,
+    and by every copy of the melody within a batch.
+    """
+    conditioner = model.lm.condition_provider.conditioners.get("self_wav")
+    if conditioner is None or getattr(conditioner, "_chroma_cached", False):
+        return
+    if not hasattr(conditioner, "_compute_wav_embedding"):
+        # not a ChromaStemConditioner, nothing to memoize
+        return
+    import torch
+    compute = conditioner._compute_wav_embedding
+
+    def _compute_wav_embedding(wav, sample_rate):
+        # wav: [B, C, T], one melody (or null condition) per row
+        chromas = []
+        for row in wav:
+            key = (model.name, _precision(model), hash_tensor(row), sample_rate, row.shape[-1])
+            chroma = chroma_cache.get(key)
+            if chroma is None:
+                chroma = compute(row[None], sample_rate)[0]
+                chroma_cache.put(key, chroma)
+            chromas.append(chroma)
+        return torch.stack(chromas)
+
+    conditioner._compute_wav_embedding = _compute_wav_embedding
+    conditioner._chroma_cached = True
+
+
+# text conditioning outputs, keyed by (model, precision, description)
+text_cache = LRUCache(
+    max_size=float(os.getenv("TEXT_CACHE_MB", 128)) * 1024 ** 2,
+    size_of=lambda entry: _tensor_bytes(entry[0]) + _tensor_bytes(entry[1]),
+)
+
+
+class _Descriptions(list):
+    """Untokenized descriptions, passed from the cached `tokenize` to the cached `forward`."""
+
+
+def enable_text_cache(model):
+    """
+    Memoize the T5 text conditioner of a model per description. Each unique description of
+    a batch is encoded at most once (the `num_outputs` copies of a prompt, the empty
+    descriptions used for classifier-free guidance), and repeated prompts skip T5 entirely.
+    """
+    conditioner = model.lm.condition_provider.conditioners.get("description")
+    if conditioner is None or getattr(conditioner, "_text_cached", False):
+        return
+    if not hasattr(conditioner, "t5_tokenizer"):
+        # not a T5Conditioner, nothing to memoize
+        return
+    import torch
+    import torch.nn.functional as F
+    tokenize = conditioner.tokenize
+    forward = conditioner.forward
+
+    def _tokenize(x):
+        # tokenization is deferred to `_forward`, for the descriptions that are not cached
+        return _Descriptions(xi if xi is not None else "" for xi in x)
+
+    def _forward(inputs):
+        with metrics.span("text_conditioning", model.name):
+            return _cached_forward(inputs)
+
+    def _cached_forward(inputs):
+        if not isinstance(inputs, _Descriptions):
+            return forward(inputs)
+        encoded = {}
+        for description in dict.fromkeys(inputs):
+            entry = text_cache.get((model.name, _precision(model), description))
+            if entry is not None:
+                encoded[description] = entry
+        missing = [description for description in dict.fromkeys(inputs) if description not in encoded]
+        if missing:
+            embeds, mask = forward(tokenize(missing))
+            for i, description in enumerate(missing):
+                # T5 pads on the right, keep the tokens of this description only
+                length = max(int(mask[i].sum()), 1)
+                entry = (embeds[i, :length].clone(), mask[i, :length].clone())
+                text_cache.put((model.name, _precision(model), description), entry)
+                encoded[description] = entry
+        max_length = max(embed.shape[0] for embed, _ in encoded.values())
+        embeds = torch.stack([
+            F.pad(encoded[description][0], (0, 0, 0, max_length - encoded[description][0].shape[0]))
+            for description in inputs
+        ])
+        mask = torch.stack([
+            F.pad(encoded[description][1], (0, max_length - encoded[description][1].shape[0]))
+            for description in inputs
+        ])
+        return embeds, mask
+
+    conditioner.tokenize = _tokenize
+    conditioner.forward = _forward
+    conditioner._text_cached = True
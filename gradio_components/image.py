@@ -1,14 +1,119 @@
 import base64
+import hashlib
+import io
 import json
 import os
+import threading
+import typing as tp
+from concurrent.futures import Future
+from pathlib import Path
 
-import anthropic
 import gradio as gr
-from openai import OpenAI
 
+from gradio_components.utils import LRUCache, hash_file
 
-# Remember to put your API Key here
-client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+_clients: tp.Dict[str, tp.Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_anthropic_client():
+    """One Anthropic client for the process, so its HTTP connection pool is reused."""
+    with _clients_lock:
+        if "anthropic" not in _clients:
+            import anthropic
+            # Remember to put your API Key here
+            _clients["anthropic"] = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        return _clients["anthropic"]
+
+
+def get_openai_client():
+    """One OpenAI client for the process, so its HTTP connection pool is reused."""
+    with _clients_lock:
+        if "openai" not in _clients:
+            from openai import OpenAI
+            _clients["openai"] = OpenAI()
+        return _clients["openai"]
+
+
+class CaptionCache:
+    """Persistent cache of captioning / prompt improvement responses, one JSON file per key.
+
+    Concurrent calls for the same key are coalesced: the first one calls the API,
+    the others wait for its result instead of making the same request.
+    """
+    def __init__(self, root: tp.Union[str, Path]):
+        self.root = Path(root)
+        self.hits = 0
+        self.misses = 0
+        self._in_flight: tp.Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+    def get_or_compute(self, key: str, compute: tp.Callable[[], dict]) -> dict:
+        path = self.root / f"{key}.json"
+        if path.exists():
+            self.hits += 1
+            return json.loads(path.read_text())
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            return future.result()
+        self.misses += 1
+        try:
+            result = compute()
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(result))
+            tmp_path.replace(path)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+# Captioning only needs a few hundred pixels, larger images just cost upload time and tokens
+CAPTION_IMAGE_MAX_EDGE = int(os.getenv("CAPTION_IMAGE_MAX_EDGE", 768))
+_preprocessed_images = LRUCache(max_size=64 * 1024 ** 2, size_of=lambda value: len(value[1]))
+
+
+def preprocess_image(image_file, max_edge: int = CAPTION_IMAGE_MAX_EDGE) -> tp.Tuple[str, str]:
+    """Decode an uploaded image, downscale it to at most `max_edge` pixels on its longest side
+    and re-encode it compactly. Returns `(media_type, base64 data)`, cached by content hash."""
+    key = (hash_file(image_file), max_edge)
+    cached = _preprocessed_images.get(key)
+    if cached is not None:
+        return cached
+    from PIL import Image, ImageOps
+
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge))
+        buffer = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            # keep transparency, JPEG can't store it
+            media_type = "image/png"
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            media_type = "image/jpeg"
+            image.convert("RGB").save(buffer, format="JPEG", quality=85, optimize=True)
+    result = (media_type, base64.b64encode(buffer.getvalue()).decode("utf-8"))
+    _preprocessed_images.put(key, result)
+    return result
+
+
+caption_cache = CaptionCache(
+    os.getenv("CAPTION_CACHE_DIR", Path.home() / ".cache" / "magic_music_machine" / "captions")
+)
 
 # image1_url = "https://i.abcnewsfe.com/a/7d849ccc-e0fe-4416-959d-85889e338add/dune-1-ht-bb-231212_1702405287482_hpMain_16x9.jpeg"
 image1_media_type = "image/jpeg"
@@ -53,51 +158,58 @@ You will be provided with a prompt and you need to improve it. Make sure the pro
 
 
 def improve_prompt(prompt):
-    message = client.messages.create(
-        model="claude-3-opus-20240229",
-        max_tokens=1024,
-        system=PROMPT_IMPROVEMENT_GENERATE_PROMPT,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                ],
-            }
-        ],
-    )
-    message_object = json.loads(message.content[0].text)
+    def _improve():
+        message = get_anthropic_client().messages.create(
+            model="claude-3-opus-20240229",
+            max_tokens=1024,
+            system=PROMPT_IMPROVEMENT_GENERATE_PROMPT,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                    ],
+                }
+            ],
+        )
+        return json.loads(message.content[0].text)
+
+    key = caption_cache.key("improve_prompt", prompt, "claude-3-opus-20240229", PROMPT_IMPROVEMENT_GENERATE_PROMPT)
+    message_object = caption_cache.get_or_compute(key, _improve)
     prompt = message_object["prompt"]
     return message_object, prompt
 
 def generate_caption_gpt4(image_file, model_file):
-    client = OpenAI()
     if model_file == "facebook/audiogen-medium":
         system_prompt = SYSTEM_PROMPT_AUDIO
     else:
         system_prompt = SYSTEM_PROMPT
-    with open(image_file, "rb") as f:
-        image_encoded = base64.b64encode(f.read()).decode("utf-8")
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-            "role": "user",
-            "content": [
-                {"type": "text", 
-                 "text": system_prompt},
+
+    def _caption():
+        media_type, image_encoded = preprocess_image(image_file)
+        response = get_openai_client().chat.completions.create(
+            model="gpt-4o",
+            messages=[
                 {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_encoded}",
-                },
-                },
+                "role": "user",
+                "content": [
+                    {"type": "text", 
+                     "text": system_prompt},
+                    {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{media_type};base64,{image_encoded}",
+                    },
+                    },
+                ],
+                }
             ],
-            }
-        ],
-        max_tokens=300,
-        )
-    message = json.loads(response.choices[0].message.content)
+            max_tokens=300,
+            )
+        return json.loads(response.choices[0].message.content)
+
+    key = caption_cache.key("caption", hash_file(image_file), CAPTION_IMAGE_MAX_EDGE, "gpt-4o", system_prompt)
+    message = caption_cache.get_or_compute(key, _caption)
     return message['description'], message['prompt']
     
 
@@ -107,33 +219,39 @@ def generate_caption_claude3(image_file, model_file, progress=gr.Progress()):
         system_prompt = SYSTEM_PROMPT_AUDIO
     else:
         system_prompt = SYSTEM_PROMPT
-    with open(image_file, "rb") as f:
-        image_encoded = base64.b64encode(f.read()).decode("utf-8")
-    progress(0, desc="Starting image captioning...")
-    message = client.messages.create(
-        model="claude-3-opus-20240229",
-        max_tokens=1024,
-        system=system_prompt,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": image1_media_type,
-                            "data": image_encoded,
+
+    def _caption():
+        media_type, image_encoded = preprocess_image(image_file)
+        message = get_anthropic_client().messages.create(
+            model="claude-3-opus-20240229",
+            max_tokens=1024,
+            system=system_prompt,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,
+                                "data": image_encoded,
+                            },
                         },
-                    },
-                    {"type": "text", "text": "develop the prompt based on this image"},
-                ],
-            }
-        ],
+                        {"type": "text", "text": "develop the prompt based on this image"},
+                    ],
+                }
+            ],
+        )
+        # Parse the content string into a Python object
+        return json.loads(message.content[0].text)
+
+    progress(0, desc="Starting image captioning...")
+    key = caption_cache.key(
+        "caption", hash_file(image_file), CAPTION_IMAGE_MAX_EDGE, "claude-3-opus-20240229", system_prompt
     )
+    message_object = caption_cache.get_or_compute(key, _caption)
     progress(100, desc="image captioning...Done!")
-    # Parse the content string into a Python object
-    message_object = json.loads(message.content[0].text)
     # Access the description and prompt from the message object
     description = message_object["description"]
     prompt = message_object["prompt"]
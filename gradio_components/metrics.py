@@ -0,0 +1,173 @@
+import bisect
+import threading
+import time
+import typing as tp
+from collections import defaultdict
+from contextlib import contextmanager
+
+from gradio_components.cancellation import Cancelled
+
+# seconds, from a cached conditioning lookup to a long-form track
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_RATE_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+Labels = tp.Tuple[tp.Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: tp.Optional[tp.Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus text format."""
+    def __init__(self, name: str, help: str, buckets: tp.Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._counts: tp.Dict[Labels, tp.List[int]] = defaultdict(lambda: [0] * len(self.buckets))
+        self._sums: tp.Dict[Labels, float] = defaultdict(float)
+        self._totals: tp.Dict[Labels, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._counts[key]
+            for i in range(bisect.bisect_left(self.buckets, value), len(self.buckets)):
+                counts[i] += 1
+            self._sums[key] += value
+            self._totals[key] += 1
+
+    def render(self) -> tp.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in self._counts.items():
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', str(bound)))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {self._totals[key]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {self._sums[key]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {self._totals[key]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: tp.Dict[Labels, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] += amount
+
+    def render(self) -> tp.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+stage_seconds = Histogram("mmm_stage_seconds", "Duration of each generation stage, by stage and model.")
+generated_tokens = Counter("mmm_generated_tokens_total", "Codec frames generated, summed over the batch, by model.")
+tokens_per_second = Histogram(
+    "mmm_tokens_per_second", "Token generation rate of each generate call, in codec frames per second, by model.",
+    TOKEN_RATE_BUCKETS,
+)
+requests_total = Counter("mmm_requests_total", "Requests handled, by entry point, model and status.")
+
+_local = threading.local()
+
+
+@contextmanager
+def span(stage: str, model: str = ""):
+    """Time a stage, recording it in `mmm_stage_seconds` and in the trace of the current request.
+
+    Stages: model_load, prompt_decode, text_conditioning, generation (token generation,
+    conditioning included), codec_decode, encode (loudness normalization and writing),
+    transcription and request.
+    """
+    be = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - be
+        stage_seconds.observe(elapsed, stage=stage, model=model)
+        spans = getattr(_local, "spans", None)
+        if spans is not None:
+            spans.append({"stage": stage, "model": model, "seconds": round(elapsed, 4)})
+
+
+@contextmanager
+def trace():
+    """Collect the spans run by the current thread into the yielded list."""
+    previous = getattr(_local, "spans", None)
+    _local.spans = []
+    try:
+        yield _local.spans
+    finally:
+        _local.spans = previous
+
+
+@contextmanager
+def request(entry: str, model: str, collect: bool = True):
+    """Count and time a request of `entry` (predict, predict_stream...), printing its spans
+    once done. Generators resume on any thread, so they pass `collect=False`."""
+    status = "ok"
+    try:
+        with (trace() if collect else _no_trace()) as spans, span("request", model):
+            yield
+    except BaseException as e:
+        # a closed stream stops its generator with GeneratorExit
+        status = "cancelled" if isinstance(e, (Cancelled, GeneratorExit)) else "error"
+        raise
+    finally:
+        requests_total.inc(entry=entry, model=model, status=status)
+        if collect:
+            print("request spans", entry, model, status, spans)
+
+
+@contextmanager
+def _no_trace():
+    yield None
+
+
+def record_tokens(model: str, frames: int, batch_size: int, seconds: float):
+    generated_tokens.inc(frames * batch_size, model=model)
+    if seconds > 0:
+        tokens_per_second.observe(frames / seconds, model=model)
+
+
+def instrument_model(model, version: str):
+    """Time the token generation and codec decode of every generation run on `model`."""
+    if getattr(model, "_instrumented", False):
+        return
+    generate_tokens = model._generate_tokens
+    decode = model.compression_model.decode
+
+    def _generate_tokens(*args, **kwargs):
+        be = time.perf_counter()
+        with span("generation", version):
+            tokens = generate_tokens(*args, **kwargs)
+        # [B, K, T] codes, T codec frames generated in parallel for the batch
+        record_tokens(version, tokens.shape[-1], tokens.shape[0], time.perf_counter() - be)
+        return tokens
+
+    def _decode(*args, **kwargs):
+        with span("codec_decode", version):
+            return decode(*args, **kwargs)
+
+    model._generate_tokens = _generate_tokens
+    model.compression_model.decode = _decode
+    model._instrumented = True
+
+
+def render() -> str:
+    lines = []
+    for metric in (stage_seconds, tokens_per_second, generated_tokens, requests_total):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
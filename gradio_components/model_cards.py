@@ -1,3 +1,4 @@
+import os
 import re
 
 TEXT_TO_MUSIC_MODELS = [
@@ -68,6 +69,29 @@ MODEL_DISCLAIMERS = {
     "facebook/audiogen-medium": "1.5B transformer decoder capable of generating sound effects conditioned on text.",
 }
 
+# inference precision of the LM on CPU: "fp32", "bf16" (autocast, where the CPU supports it)
+# or "int8" (dynamic quantization of the transformer linears), see gradio_components/precision.py
+MODEL_PRECISION = {
+    "facebook/musicgen-small": "fp32",
+    "facebook/musicgen-medium": "fp32",
+    "facebook/musicgen-large": "fp32",
+    "facebook/musicgen-melody": "fp32",
+    "facebook/musicgen-melody-large": "fp32",
+    'facebook/magnet-small-10secs': "fp32",
+    'facebook/magnet-medium-10secs': "fp32",
+    'facebook/magnet-small-30secs': "fp32",
+    'facebook/magnet-medium-30secs': "fp32",
+    'facebook/audio-magnet-small': "fp32",
+    'facebook/audio-magnet-medium': "fp32",
+    "facebook/audiogen-medium": "fp32",
+}
+
+
+def precision_for(version):
+    """Precision of `version`, `MODEL_PRECISION` overridden for every checkpoint by the env variable."""
+    return os.getenv("MODEL_PRECISION") or MODEL_PRECISION.get(version, "fp32")
+
+
 
 
 def print_model_cards():
@@ -0,0 +1,89 @@
+import hashlib
+import io
+import os
+import typing as tp
+
+from gradio_components.startup import timed_import
+from gradio_components.utils import LRUCache
+
+# formats the clips can be encoded to, through torchaudio's ffmpeg/sox backends
+OUTPUT_FORMATS = ("wav", "mp3", "ogg", "flac")
+
+
+def encode_clip(output, sample_rate: int, output_format: str = "wav") -> bytes:
+    """Loudness-normalize a [C, T] output as `audio_write` does and encode it in memory."""
+    torchaudio = timed_import("torchaudio")
+    from audiocraft.data.audio_utils import normalize_audio
+    wav = normalize_audio(
+        output, strategy="loudness", loudness_headroom_db=16, loudness_compressor=True, sample_rate=sample_rate
+    )
+    kwargs = {"encoding": "PCM_S", "bits_per_sample": 16} if output_format in ("wav", "flac") else {}
+    buffer = io.BytesIO()
+    torchaudio.save(buffer, wav, sample_rate, format=output_format, **kwargs)
+    return buffer.getvalue()
+
+
+class ClipStore:
+    """Encoded clips held in memory and handed to the UI as references `clip-<sha256>.<format>`,
+    so serving a clip does not go through a temporary file of ours.
+
+    A clip is only written to disk, in the `ArtifactStore`, when something needs a file:
+    the audio cache, a transcription without the in-memory waveform, a download.
+    References that are not clips are plain paths and are passed through.
+    """
+    PREFIX = "clip-"
+
+    def __init__(self, artifact_store, max_bytes: float = 512 * 1024 ** 2,
+                 output_format: str = "wav", in_memory: bool = True):
+        self.artifact_store = artifact_store
+        self.output_format = output_format
+        # serve clips from memory, or write every clip to a file right away
+        self.in_memory = in_memory
+        self._clips = LRUCache(max_size=max_bytes, size_of=len)
+        self._paths = LRUCache(max_size=4096)
+
+    def put(self, data: bytes, output_format: str) -> str:
+        ref = f"{self.PREFIX}{hashlib.sha256(data).hexdigest()}.{output_format}"
+        self._clips.put(ref, data)
+        return ref
+
+    @classmethod
+    def is_clip(cls, ref) -> bool:
+        return isinstance(ref, str) and ref.startswith(cls.PREFIX)
+
+    @classmethod
+    def content_hash(cls, ref: str) -> str:
+        """sha256 of the encoded clip, the same as `hash_file` of its persisted file."""
+        return ref[len(cls.PREFIX):].split(".")[0]
+
+    def value(self, ref: str) -> tp.Union[bytes, str, None]:
+        """What to give a `gr.Audio`: the encoded bytes of a clip, or the path of a file."""
+        if not self.is_clip(ref):
+            return ref
+        data = self._clips.get(ref)
+        if data is not None:
+            return data
+        try:
+            return self.path(ref)
+        except KeyError:
+            return None
+
+    def path(self, ref: str) -> str:
+        """Path of `ref` on disk, writing the clip there on first use."""
+        if not self.is_clip(ref):
+            return ref
+        path = self._paths.get(ref)
+        # swept, or moved to the audio cache
+        if path is not None and os.path.exists(path):
+            return path
+        data = self._clips.get(ref)
+        if data is None:
+            raise KeyError(f"{ref} is no longer in memory")
+        store = self.artifact_store
+        with store.pinned(store.new_file("." + ref.rsplit(".", 1)[-1])) as path, open(path, "wb") as f:
+            f.write(data)
+        self._paths.put(ref, path)
+        return path
+
+    def stats(self) -> dict:
+        return {"clips": self._clips.stats(), "persisted": len(self._paths)}
@@ -0,0 +1,76 @@
+import os
+import time
+import typing as tp
+from pathlib import Path
+
+from gradio_components.startup import timed_import
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# quantized LMs, so reloading a checkpoint skips the quantization
+QUANTIZED_CACHE_DIR = Path(
+    os.getenv("QUANTIZED_CACHE_DIR", Path.home() / ".cache" / "magic_music_machine" / "quantized")
+)
+
+
+def _cache_path(version: str, precision: str) -> Path:
+    torch = timed_import("torch")
+    # pickled modules only load back with the torch version that wrote them
+    # "transformer": only the transformer and output linears are quantized, see `load_lm`
+    name = f"{version.replace('/', '--')}-{precision}-transformer-torch{torch.__version__}.pt"
+    return QUANTIZED_CACHE_DIR / name
+
+
+def bf16_supported() -> bool:
+    torch = timed_import("torch")
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def load_lm(version: str, precision: str, load: tp.Callable[[], tp.Any]):
+    """LM of `version` at `precision`, from the disk cache if it was quantized before.
+
+    `load` returns the full precision LM, it is only called on a cache miss.
+    """
+    torch = timed_import("torch")
+    if precision != "int8":
+        return load()
+    path = _cache_path(version, precision)
+    if path.exists():
+        try:
+            lm = torch.load(path, map_location="cpu", weights_only=False)
+            print("Loaded quantized LM", path)
+            return lm
+        except Exception as e:
+            print(f"Error while loading the quantized LM {path}, quantizing again: {e}")
+    lm = load()
+    be = time.time()
+    # weights in int8, activations quantized on the fly, for the linears of the transformer (attention
+    # and MLPs) and the output heads. The conditioners stay in fp32: their forward reads
+    # `output_proj.weight`, which is not a tensor on a quantized linear.
+    for name in ("transformer", "linears"):
+        setattr(lm, name, torch.ao.quantization.quantize_dynamic(
+            getattr(lm, name), {torch.nn.Linear}, dtype=torch.qint8
+        ))
+    print(f"Quantized {version} to int8 in {time.time() - be:.2f}s")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        torch.save(lm, tmp)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"Error while caching the quantized LM to {path}: {e}")
+    return lm
+
+
+def apply_precision(model, precision: str):
+    """Run the token generation of `model` in bf16 autocast, when the CPU supports it."""
+    if precision != "bf16":
+        return
+    if not bf16_supported():
+        print("bf16 is not supported by this CPU, generating in fp32")
+        return
+    from audiocraft.utils.autocast import TorchAutocast
+    model.autocast = TorchAutocast(enabled=True, device_type="cpu", dtype=timed_import("torch").bfloat16)
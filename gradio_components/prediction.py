@@ -1,72 +1,232 @@
+import contextlib
+import os
+import threading
 import time
+import wave
+from collections import OrderedDict, defaultdict
 from pathlib import Path
-from tempfile import NamedTemporaryFile
+from tempfile import gettempdir
 
-import basic_pitch
-import basic_pitch.inference
 import gradio as gr
-import torch
-from audiocraft.data.audio import audio_write
-from audiocraft.data.audio_utils import convert_audio
-from audiocraft.models import AudioGen, MusicGen, MAGNeT
-from basic_pitch import ICASSP_2022_MODEL_PATH
+import numpy as np
+# torch, torchaudio and audiocraft are imported on first use, see gradio_components.startup
 # from transformers import AutoModelForSeq2SeqLM
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import typing as tp
 import warnings
 import json
 import ast
-import torchaudio
+import functools
 
-MODEL = None
+from gradio_components import metrics
+from gradio_components.artifacts import ArtifactStore
+from gradio_components.audio_cache import AudioCache
+from gradio_components.batching import BatchScheduler
+from gradio_components.cancellation import CancelRegistry, CancelToken, Cancelled
+from gradio_components.compilation import CompiledLMCache
+from gradio_components.conditioning import enable_chroma_cache, enable_text_cache
+from gradio_components.outputs import ClipStore, encode_clip
+from gradio_components.model_cards import precision_for
+from gradio_components.precision import apply_precision, load_lm
+from gradio_components.prewarm import Prewarmer
+from gradio_components.results import GenerationResult, clip_refs
+from gradio_components.startup import timed_import
+from gradio_components.transcription import TranscriptionEngine, TranscriptionQueue
+from gradio_components.utils import LRUCache, hash_audio_input
+from gradio_components.workers import WorkerPool
 
-def load_model(version='facebook/musicgen-large'):
-    global MODEL
-    if MODEL is None or MODEL.name != version:
-        del MODEL
-        MODEL = None  # in case loading would crash
-    print("Loading model", version)
+class ModelRegistry:
+    """Keeps several pretrained checkpoints resident, evicting the least recently used
+    ones once the estimated parameter memory goes over `memory_budget` (in bytes)."""
+    def __init__(self, memory_budget: float = 16 * 1024 ** 3):
+        self.memory_budget = memory_budget
+        self.models: tp.OrderedDict[str, tp.Any] = OrderedDict()
+        self.sizes: tp.Dict[str, int] = {}
+        self.load_times: tp.Dict[str, tp.List[float]] = defaultdict(list)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._load_locks: tp.Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._model_locks: tp.Dict[str, threading.RLock] = defaultdict(threading.RLock)
+
+    def get(self, version: str):
+        with self._lock:
+            if version in self.models:
+                self.hits += 1
+                self.models.move_to_end(version)
+                return self.models[version]
+        # only one thread loads a given checkpoint, the others wait and reuse it
+        with self._load_locks[version]:
+            with self._lock:
+                if version in self.models:
+                    self.hits += 1
+                    self.models.move_to_end(version)
+                    return self.models[version]
+                self.misses += 1
+                self._evict(self.sizes.get(version, 0))
+            print("Loading model", version)
+            be = time.time()
+            with metrics.span("model_load", version):
+                model = _load_pretrained(version)
+            if model is None:
+                return None
+            enable_text_cache(model)
+            # before the metrics, so the generation span includes the compilation
+            compiled_lm.install(model, version)
+            metrics.instrument_model(model, version)
+            load_time = time.time() - be
+            size = _model_size(model)
+            with self._lock:
+                self.load_times[version].append(load_time)
+                self.sizes[version] = size
+                self.models[version] = model
+                self._evict(0, keep=version)
+            print(f"Loaded model {version} in {load_time:.2f}s ({size / 1024 ** 3:.2f} GB)", self.stats())
+            return model
+
+    def model_lock(self, version: str) -> threading.RLock:
+        """Lock serializing `set_generation_params` + `generate` on one checkpoint."""
+        return self._model_locks[version]
+
+    def _evict(self, incoming: int, keep: tp.Optional[str] = None):
+        evicted = False
+        for version in list(self.models):
+            if sum(self.sizes[v] for v in self.models) + incoming <= self.memory_budget:
+                break
+            if version == keep:
+                continue
+            print("Evicting model", version)
+            del self.models[version]
+            evicted = True
+        if evicted:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "resident": list(self.models),
+            "resident_gb": round(sum(self.sizes[v] for v in self.models) / 1024 ** 3, 2),
+            "load_times": {k: [round(t, 2) for t in v] for k, v in self.load_times.items()},
+        }
+
+
+def _load_pretrained(version):
+    models = timed_import("audiocraft.models")
+    precision = precision_for(version)
+    if precision != "fp32":
+        import torch
+        if torch.cuda.is_available():
+            # audiocraft already generates in fp16 autocast on GPU
+            print(f"{precision} inference is for CPU, loading {version} as is")
+        elif "musiclang" not in version:
+            return _load_reduced_precision(version, precision)
     if "magnet" in version:
-        MODEL = MAGNeT.get_pretrained(version)
+        return models.MAGNeT.get_pretrained(version)
     elif "musicgen" in version:
-        MODEL = MusicGen.get_pretrained(version)
+        return models.MusicGen.get_pretrained(version)
     elif "musiclang" in version:
         # TODO: Implement MusicLang
-        pass
+        return None
     elif "audiogen" in version:
-        MODEL = AudioGen.get_pretrained(version)
+        return models.AudioGen.get_pretrained(version)
     else:
         raise ValueError("Invalid model version")
-    
-    return MODEL
-
-pool = ProcessPoolExecutor(4)
-class FileCleaner:
-    def __init__(self, file_lifetime: float = 3600):
-        self.file_lifetime = file_lifetime
-        self.files = []
-
-    def add(self, path: tp.Union[str, Path]):
-        self._cleanup()
-        self.files.append((time.time(), Path(path)))
-
-    def _cleanup(self):
-        now = time.time()
-        for time_added, path in list(self.files):
-            if now - time_added > self.file_lifetime:
-                if path.exists():
-                    path.unlink()
-                self.files.pop(0)
-            else:
-                break
-                
-file_cleaner = FileCleaner()
 
-def inference_musicgen_text_to_music(model, configs, text, num_outputs=1):
+
+def _load_reduced_precision(version, precision):
+    """`_load_pretrained` at `precision`, as the `get_pretrained` of each model class does
+    but with the LM going through `load_lm`, which keeps quantized LMs on disk."""
+    models = timed_import("audiocraft.models")
+    loaders = timed_import("audiocraft.models.loaders")
+    compression_model = loaders.load_compression_model(version, device="cpu")
+    if "magnet" in version:
+        model_class = models.MAGNeT
+        lm = load_lm(version, precision, lambda: loaders.load_lm_model_magnet(
+            version, compression_model_frame_rate=int(compression_model.frame_rate), device="cpu"
+        ))
+    elif "musicgen" in version:
+        model_class = models.MusicGen
+        lm = load_lm(version, precision, lambda: loaders.load_lm_model(version, device="cpu"))
+    elif "audiogen" in version:
+        model_class = models.AudioGen
+        lm = load_lm(version, precision, lambda: loaders.load_lm_model(version, device="cpu"))
+    else:
+        raise ValueError("Invalid model version")
+    if "self_wav" in lm.condition_provider.conditioners:
+        lm.condition_provider.conditioners["self_wav"].match_len_on_eval = True
+        if model_class is models.MusicGen:
+            lm.condition_provider.conditioners["self_wav"]._use_masking = False
+    model = model_class(version, compression_model, lm)
+    apply_precision(model, precision)
+    # part of the conditioning cache keys, bf16 autocast changes the conditioning outputs
+    model.precision = precision
+    return model
+
+
+def _model_size(model) -> int:
+    import torch
+    modules = [model.lm, model.compression_model]
+    # T5 lives outside of the LM parameters, see audiocraft T5Conditioner
+    for conditioner in model.lm.condition_provider.conditioners.values():
+        if isinstance(getattr(conditioner, "t5", None), torch.nn.Module):
+            modules.append(conditioner.t5)
+    # int8 linears keep their weights in packed params, not in parameters
+    return sum(_tensor_bytes(v) for module in modules for v in module.state_dict().values())
+
+
+def _tensor_bytes(value) -> int:
+    import torch
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+
+model_registry = ModelRegistry(float(os.getenv("MODEL_CACHE_GB", 16)) * 1024 ** 3)
+compiled_lm = CompiledLMCache(
+    enabled=os.getenv("COMPILE_LM", "0") == "1",
+    mode=os.getenv("COMPILE_MODE", "default"),
+)
+
+def load_model(version='facebook/musicgen-large'):
+    return model_registry.get(version)
+
+prewarmer = Prewarmer(load_model, model_registry.model_lock)
+
+# audio_write normalizes with torch and pipes to ffmpeg, both release the GIL,
+# so threads encode in parallel without pickling the output tensors to a process.
+encode_pool = ThreadPoolExecutor(int(os.getenv("ENCODE_WORKERS", 4)), thread_name_prefix="encode")
+# under the system temp directory, which gradio serves files from
+artifact_store = ArtifactStore(
+    os.getenv("ARTIFACT_DIR", Path(gettempdir()) / "magic_music_machine"),
+    file_lifetime=float(os.getenv("ARTIFACT_LIFETIME", 3600)),
+    max_bytes=float(os.getenv("ARTIFACT_QUOTA_GB", 4)) * 1024 ** 3,
+)
+clip_store = ClipStore(
+    artifact_store,
+    max_bytes=float(os.getenv("CLIP_CACHE_MB", 512)) * 1024 ** 2,
+    output_format=os.getenv("OUTPUT_FORMAT", "wav"),
+    in_memory=os.getenv("SERVE_FROM_MEMORY", "1") != "0",
+)
+batch_scheduler = BatchScheduler(model_registry.model_lock)
+transcription_engine = TranscriptionEngine()
+transcription_queue = TranscriptionQueue(transcription_engine, new_file=artifact_store.new_file)
+cancel_registry = CancelRegistry()
+# empty unless started with a number of workers, generations then run in the worker processes
+worker_pool = WorkerPool()
+audio_cache = AudioCache(
+    os.getenv("AUDIO_CACHE_DIR", Path.home() / ".cache" / "magic_music_machine" / "audio"),
+    float(os.getenv("AUDIO_CACHE_GB", 2)) * 1024 ** 3,
+)
+
+def inference_musicgen_text_to_music(model, configs, descriptions):
     model.set_generation_params(
         **configs
     )
-    descriptions = [text for _ in range(num_outputs)]
     output = model.generate(descriptions=descriptions ,progress=True, return_tokens=False)
     return output
 
@@ -81,38 +241,38 @@ def inference_musicgen_continuation(model, configs, text, prompt_waveform, promp
     return output
 
 def inference_musicgen_melody_condition(model, configs, text, prompt_waveform, prompt_sr, num_outputs=1):
+    enable_chroma_cache(model)
     model.set_generation_params(**configs)
-    descriptions = [text for _ in range(num_outputs)]
+    descriptions = [text for _ in range(int(num_outputs))]
+    # one melody per description, the chroma is computed once for all the copies
+    melody_wavs = [prompt_waveform] * len(descriptions) if prompt_waveform.dim() == 2 else prompt_waveform
     output = model.generate_with_chroma(
         descriptions=descriptions,
-        melody_wavs=prompt_waveform,
+        melody_wavs=melody_wavs,
         melody_sample_rate=prompt_sr,
         progress=True, 
         return_tokens=False
     )
     return output
 
-def inference_magnet(model, configs, text, num_outputs=1):
+def inference_magnet(model, configs, descriptions):
     model.set_generation_params(
         **configs
     )
-    descriptions = [text for _ in range(num_outputs)]
     output = model.generate(descriptions=descriptions, progress=True, return_tokens=False)
     return output
 
-def inference_magnet_audio(model, configs, text, num_outputs=1):
+def inference_magnet_audio(model, configs, descriptions):
     model.set_generation_params(
         **configs
     )
-    descriptions = [text for _ in range(num_outputs)]
     output = model.generate(descriptions=descriptions, progress=True, return_tokens=False)
     return output
     
-def inference_audiogen(model, configs, text, num_outputs=1):
+def inference_audiogen(model, configs, descriptions):
     model.set_generation_params(
         **configs
     )
-    descriptions = [text for _ in range(num_outputs)]
     output = model.generate(descriptions=descriptions, progress=True, return_tokens=False)
     return output
 
@@ -121,11 +281,48 @@ def inference_musiclang():
     pass
 
 
-def process_audio(gr_audio, prompt_duration, model):
-    # audio, sr = torch.from_numpy(gr_audio[1]).to(model.device).float().t(), gr_audio[0]
-    audio, sr = torchaudio.load(gr_audio)
-    audio = audio[..., :int(prompt_duration * sr)]
-    return audio, sr
+# decoded melody prompts, bounded by their size in bytes
+_melody_prompts = LRUCache(
+    max_size=float(os.getenv("MELODY_CACHE_MB", 512)) * 1024 ** 2,
+    size_of=lambda audio: audio.numel() * audio.element_size(),
+)
+
+def process_audio(gr_audio, prompt_duration, model, audio_hash=None):
+    """
+    Decode the first `prompt_duration` seconds of a melody prompt, resampled once to the
+    model's sample rate and channels. Only that window is decoded, so memory and time
+    don't grow with the length of the upload, and decoded prompts are cached by content hash.
+    """
+    if audio_hash is None:
+        audio_hash = hash_audio_input(gr_audio)
+    key = (audio_hash, prompt_duration, model.sample_rate, model.audio_channels)
+    audio = _melody_prompts.get(key)
+    if audio is not None:
+        return audio, model.sample_rate
+    import torch
+    torchaudio = timed_import("torchaudio")
+    from audiocraft.data.audio_utils import convert_audio
+    with metrics.span("prompt_decode", model.name):
+        if isinstance(gr_audio, (tuple, list)):
+            # gr.Audio(type="numpy"): (sample_rate, [T] or [T, C] array)
+            sr, data = gr_audio
+            data = data[:int(prompt_duration * sr)]
+            audio = torch.from_numpy(data).float()
+            if data.dtype.kind == "i":
+                audio = audio / (np.iinfo(data.dtype).max + 1)
+            audio = audio[None] if audio.dim() == 1 else audio.t()
+        else:
+            sr = torchaudio.info(gr_audio).sample_rate
+            audio, sr = torchaudio.load(gr_audio, frame_offset=0, num_frames=int(prompt_duration * sr))
+        audio = convert_audio(audio, sr, model.sample_rate, model.audio_channels)
+    _melody_prompts.put(key, audio)
+    return audio, model.sample_rate
+
+# `torch.manual_seed` seeds the RNG of the whole process: seeded generations run one at a time,
+# across checkpoints. An unseeded generation of another checkpoint running meanwhile still draws
+# from the same RNG, so a seed is only reproducible without concurrent requests; the audio cache
+# then serves the same clips for the same seed.
+_seed_lock = threading.Lock()
 
 _MODEL_INFERENCES = {
     "facebook/musicgen-small": inference_musicgen_text_to_music,
@@ -143,7 +340,13 @@ _MODEL_INFERENCES = {
     "musicgen-continuation": inference_musicgen_continuation,
 }
 
-def _do_predictions(
+def _do_predictions(*args, **kwargs) -> GenerationResult:
+    """The complete result of `_iter_predictions`."""
+    for result in _iter_predictions(*args, **kwargs):
+        pass
+    return result
+
+def _iter_predictions(
     model_file,
     model,
     text,
@@ -151,8 +354,14 @@ def _do_predictions(
     mel_sample_rate=None,
     progress=False,
     num_generations=1,
+    progress_callback=None,
+    seed=None,
+    transcribe_midi=False,
+    cancel_token=None,
+    in_memory=None,
     **gen_kwargs,
 ):
+    import torch
     print(
         "new generation",
         text,
@@ -168,37 +377,98 @@ def _do_predictions(
             else:
                 # melody continuation 
                 inderence_func = _MODEL_INFERENCES['musicgen-continuation']
-            outputs = inderence_func(model, gen_kwargs, text, melody, mel_sample_rate, num_generations)
+            seed_lock = _seed_lock if seed is not None else contextlib.nullcontext()
+            # the progress callback and generation params live on the shared model
+            with seed_lock, model_registry.model_lock(model_file):
+                model.set_custom_progress_callback(progress_callback)
+                if seed is not None:
+                    torch.manual_seed(seed)
+                outputs = inderence_func(model, gen_kwargs, text, melody, mel_sample_rate, num_generations)
+        elif seed is not None:
+            # seeded outputs depend on the batch content, so they are generated on their own
+            inderence_func = _MODEL_INFERENCES[model_file]
+            with _seed_lock, model_registry.model_lock(model_file):
+                model.set_custom_progress_callback(progress_callback)
+                torch.manual_seed(seed)
+                outputs = inderence_func(model, gen_kwargs, [text] * int(num_generations))
         else:
-            # text-to-music, text-to-sound
+            # text-to-music, text-to-sound, batched with concurrent compatible requests
             inderence_func = _MODEL_INFERENCES[model_file]
-            outputs = inderence_func(model, gen_kwargs, text, num_generations)
+            outputs = batch_scheduler.generate(
+                model_file, model, inderence_func, gen_kwargs, text, num_generations, progress_callback,
+                cancel_token,
+            )
 
     except RuntimeError as e:
         raise gr.Error("Error while generating " + e.args[0])
     outputs = outputs.detach().cpu().float()
-    out_audios = []
-    video_processes = []
-    for output in outputs:
-        with NamedTemporaryFile("wb", suffix=".wav", delete=False) as file:
-            audio_write(
-                file.name,
-                output,
-                model.sample_rate,
-                strategy="loudness",
-                loudness_headroom_db=16,
-                loudness_compressor=True,
-                add_suffix=False,
+    timings = {"generation": round(time.time() - be, 3)}
+    print("generation finished", len(outputs), timings["generation"])
+    if cancel_token is not None:
+        # cancelled by the last progress update, no need to encode
+        cancel_token.raise_if_cancelled()
+    be = time.time()
+    in_memory = clip_store.in_memory if in_memory is None else in_memory
+    result = GenerationResult(
+        clips=[None] * len(outputs),
+        model=model_file,
+        durations=[round(outputs.shape[-1] / model.sample_rate, 3)] * len(outputs),
+        sample_rate=model.sample_rate,
+        timings=timings,
+    )
+    for i, ref in _iter_encoded(outputs, model.sample_rate, model_file, in_memory):
+        result.clips[i] = ref
+        if not ClipStore.is_clip(ref):
+            # the size is known once the file is written
+            artifact_store.add(ref)
+        if not transcribe_midi:
+            continue
+        # starts right away in the background, from the in-memory output
+        if ClipStore.is_clip(ref):
+            transcription_queue.submit(None, (outputs[i], model.sample_rate), key=ClipStore.content_hash(ref))
+        else:
+            # the file is kept until then since its content hash keys the result
+            artifact_store.pin(ref)
+            transcription_queue.submit(ref, (outputs[i], model.sample_rate)).add_done_callback(
+                lambda _, path=ref: artifact_store.unpin(path)
             )
-            # video_processes.append(pool.submit(make_waveform, file.name))
-            out_audios.append(file.name)
-            file_cleaner.add(file.name)
+        if None in result.clips:
+            # partial, the clips still being encoded are None
+            yield result
+    # video_processes = [encode_pool.submit(make_waveform, path) for path in out_audios]
     # out_videos = [video.result() for video in video_processes]
     # for video in out_videos:
-        # file_cleaner.add(video)
-    
-    print("generation finished", len(outputs), time.time() - be)
-    return out_audios
+        # artifact_store.add(video)
+    timings["encode"] = round(time.time() - be, 3)
+    print("encoding finished", len(outputs), timings["encode"])
+    yield result
+
+def _encode_output(output, sample_rate, path=None, model_version="", output_format="wav"):
+    with metrics.span("encode", model_version):
+        data = encode_clip(output, sample_rate, output_format)
+    if path is None:
+        path = artifact_store.new_file("." + output_format)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def _encode_clip(output, sample_rate, model_version="", output_format="wav"):
+    with metrics.span("encode", model_version):
+        return clip_store.put(encode_clip(output, sample_rate, output_format), output_format)
+
+def _iter_encoded(outputs, sample_rate, model_version="", in_memory=False):
+    """Loudness-normalize and encode every output on the encode pool, in `clip_store.output_format`,
+    yielding `(index, reference)` pairs in the order they finish. References are in-memory clips
+    of `clip_store` if `in_memory`, file paths otherwise."""
+    if in_memory:
+        encode = functools.partial(_encode_clip, sample_rate=sample_rate, model_version=model_version,
+                                   output_format=clip_store.output_format)
+    else:
+        encode = functools.partial(_encode_output, sample_rate=sample_rate, model_version=model_version,
+                                   output_format=clip_store.output_format)
+    futures = {encode_pool.submit(encode, output): i for i, output in enumerate(outputs)}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
 
 def make_waveform(*args, **kwargs):
     # Further remove some warnings.
@@ -209,63 +479,380 @@ def make_waveform(*args, **kwargs):
         print("Make a video took", time.time() - be)
         return out
     
+def _session(request):
+    return request.session_hash if request is not None else None
+
+def cancel_requests(request: gr.Request, groups=None):
+    """Stop the generations in flight of the caller's session in `groups`, every one of them
+    if None, e.g. on page unload."""
+    cancelled = cancel_registry.cancel(_session(request), groups)
+    if cancelled:
+        print("cancelled", cancelled, "requests of session", _session(request), groups or "")
+
+def cancel_handler(*groups):
+    """Event handler of a stop button, cancelling the caller's generations started with one of
+    `groups` as `cancel_group`."""
+    def cancel(request: gr.Request):
+        cancel_requests(request, groups)
+    cancel.__name__ = "cancel_" + "_".join(groups)
+    return cancel
+
 def predict(
     model_version,
     generation_configs,
     prompt_text=None,
     prompt_wav=None,
     num_generations=1,
+    seed=None,
+    transcribe_midi=False,
+    request: gr.Request = None,
     progress=gr.Progress(),
+    cancel_group="text",
+):
+    """Generate `num_generations` clips, yielding the `GenerationResult` (as a dict) each time a
+    clip is encoded, the clips not encoded yet being None, and the complete result last.
+    `cancel_group` is what the stop button of the caller cancels, see `cancel_handler`."""
+    with cancel_registry.open(_session(request), cancel_group) as token:
+        try:
+            with metrics.request("predict", model_version, collect=False):
+                yield from _predict(
+                    token, model_version, generation_configs, prompt_text, prompt_wav,
+                    num_generations, seed, transcribe_midi, progress,
+                )
+        except Cancelled:
+            raise gr.Error("Interrupted.")
+
+def _predict(
+    cancel_token,
+    model_version,
+    generation_configs,
+    prompt_text,
+    prompt_wav,
+    num_generations,
+    seed,
+    transcribe_midi,
+    progress,
 ):
-    global INTERRUPTING
-    INTERRUPTING = False
+    be = time.time()
     progress(0, desc="Loading model...")
     def _progress(generated, to_generate):
         nonlocal max_generated
         max_generated = max(generated, max_generated)
         progress((min(max_generated, to_generate), to_generate))
-        if INTERRUPTING:
-            raise gr.Error("Interrupted.")
+        cancel_token.raise_if_cancelled()
 
-    model = load_model(model_version)
-    model.set_custom_progress_callback(_progress)
     if isinstance(generation_configs, str):
         generation_configs = ast.literal_eval(generation_configs)
-    max_generated = 0
-    if prompt_wav is not None:
-        melody, mel_sample_rate = process_audio(prompt_wav, generation_configs['duration'], model) 
+    # a negative or missing seed means random outputs, which are not cached
+    seed = None if seed is None or seed < 0 else int(seed)
+    cache_key = None
+    melody_hash = hash_audio_input(prompt_wav) if prompt_wav is not None else None
+    if seed is not None:
+        cache_key = audio_cache.key(
+            model_version, prompt_text, generation_configs, melody_hash, seed, num_generations,
+            clip_store.output_format, precision_for(model_version),
+        )
+        cached = audio_cache.get(cache_key)
+        if cached is not None:
+            print("audio cache hit", cache_key, audio_cache.stats())
+            if transcribe_midi:
+                for path in cached:
+                    transcription_queue.submit(path)
+            result = GenerationResult.from_dict({**audio_cache.meta(cache_key), "clips": cached})
+            result.cache_hit = True
+            result.timings = {"request": round(time.time() - be, 3)}
+            yield result.to_dict()
+            return
+
+    if worker_pool.enabled:
+        progress(0, desc="Generating...")
+        result = worker_pool.submit(
+            model_version, _generate_in_worker,
+            model_version, generation_configs, prompt_text, prompt_wav, num_generations, seed, melody_hash,
+            cancel_token=cancel_token,
+        ).result()
+        for path in result.clips:
+            artifact_store.add(path)
+            if transcribe_midi:
+                transcription_queue.submit(path)
     else:
-        melody, mel_sample_rate = None, None
+        model = load_model(model_version)
+        max_generated = 0
+        if prompt_wav is not None:
+            melody, mel_sample_rate = process_audio(prompt_wav, generation_configs['duration'], model, melody_hash) 
+        else:
+            melody, mel_sample_rate = None, None
+
+        for result in _iter_predictions(
+            model_version,
+            model,
+            prompt_text,
+            melody,
+            mel_sample_rate,
+            progress=True,
+            num_generations = num_generations,
+            progress_callback=_progress,
+            seed=seed,
+            transcribe_midi=transcribe_midi,
+            cancel_token=cancel_token,
+            **generation_configs,
+        ):
+            # seeded clips are moved to the audio cache once all are encoded, the UI only gets their final paths
+            if None in result.clips and cache_key is None:
+                yield result.to_dict()
+    if cache_key is not None:
+        # moved into the audio cache, which manages them from now on
+        paths = [clip_store.path(ref) for ref in result.clips]
+        for path in paths:
+            artifact_store.discard(path)
+        meta = {k: v for k, v in result.to_dict().items() if k not in ("clips", "timings")}
+        result.clips = audio_cache.put(cache_key, paths, meta)
+    result.timings["request"] = round(time.time() - be, 3)
+    yield result.to_dict()
 
 
+def _warm_in_worker(model_version):
+    # the prewarmer of the worker process, same warmup as without workers
+    prewarmer.warmup(model_version)
+    return None, list(model_registry.models)
 
-    audios = _do_predictions(
+def _generate_in_worker(model_version, generation_configs, prompt_text, prompt_wav, num_generations, seed, melody_hash,
+                        cancel_event=None):
+    """`predict` past the audio cache, run in a worker process of `worker_pool`.
+    Stops with `Cancelled` once `cancel_event` is set by the server process."""
+    cancel_token = CancelToken()
+
+    def _progress(generated, to_generate):
+        if cancel_event is not None and cancel_event.is_set():
+            cancel_token.cancel()
+        cancel_token.raise_if_cancelled()
+
+    model = load_model(model_version)
+    # cancelled while loading
+    _progress(0, 0)
+    if prompt_wav is not None:
+        melody, mel_sample_rate = process_audio(prompt_wav, generation_configs['duration'], model, melody_hash)
+    else:
+        melody, mel_sample_rate = None, None
+    result = _do_predictions(
         model_version,
         model,
         prompt_text,
         melody,
         mel_sample_rate,
-        progress=True,
-        num_generations = num_generations,
+        num_generations=num_generations,
+        progress_callback=_progress,
+        seed=seed,
+        cancel_token=cancel_token,
+        # the clips are served by the main process, from files
+        in_memory=False,
         **generation_configs,
     )
-    return audios
+    return result, list(model_registry.models)
+
+def start_workers(num_workers, versions=()):
+    # spawned workers build their registry and encoder settings from the environment
+    os.environ["MODEL_CACHE_GB"] = str(model_registry.memory_budget / 1024 ** 3)
+    os.environ["OUTPUT_FORMAT"] = clip_store.output_format
+    os.environ["COMPILE_LM"] = "1" if compiled_lm.enabled else "0"
+    # per-worker readiness, reported again when a dead worker is respawned
+    worker_pool.start(num_workers, _warm_in_worker, versions, on_preload=prewarmer.track)
+
+
+STREAM_CHUNK_SECONDS = 5
+STREAM_CONTEXT_SECONDS = 10
+
+def _continuation_windows(model_version, model, configs, text, duration, window_seconds, context_seconds,
+                          progress_callback=None, context=None):
+    """Generate `duration` seconds as a chain of windows, each continuing from the last
+    `context_seconds` of audio generated so far, or of `context` for the first window.
+
+    Yields `(window, prompt_length)` with `window` the decoded [C, T] audio of the window,
+    whose first `prompt_length` samples are the re-decoded context.
+    """
+    # keep the context on codec frame boundaries so it maps back to a whole number of tokens
+    hop_length = int(model.sample_rate // model.frame_rate)
+    context_seconds = min(context_seconds, model.max_duration - window_seconds)
+    context_length = int(context_seconds * model.frame_rate) * hop_length
+    if context is not None:
+        context = context[..., -context_length:] if context_length > 0 else None
+    if context is not None:
+        context = context[..., context.shape[-1] % hop_length:]
+        if context.shape[-1] == 0:
+            context = None
+    produced = 0.
+    while produced < duration:
+        step = min(window_seconds, duration - produced)
+        prompt_seconds = 0 if context is None else context.shape[-1] / model.sample_rate
+
+        def _progress(generated, to_generate, offset=produced, step=step):
+            if progress_callback is not None:
+                done = offset + step * min(generated, to_generate) / max(to_generate, 1)
+                progress_callback(done, duration)
+
+        with model_registry.model_lock(model_version):
+            model.set_custom_progress_callback(_progress)
+            model.set_generation_params(**{**configs, "duration": prompt_seconds + step})
+            if context is None:
+                window = model.generate(descriptions=[text], progress=True, return_tokens=False)[0]
+            else:
+                window = model.generate_continuation(
+                    context, model.sample_rate, descriptions=[text], progress=True, return_tokens=False
+                )[0]
+        window = window.detach().cpu().float()
+        prompt_length = 0 if context is None else context.shape[-1]
+        yield window, prompt_length
+        context = window[..., -context_length:] if context_length > 0 else None
+        produced += step
+
+def _to_int16(wav):
+    import torch
+    # fixed scaling instead of gradio's per-chunk peak normalization, which would make the volume jump
+    return (wav.clamp(-1, 1) * 32767).to(torch.int16).t().numpy()
+
+def predict_stream(
+    model_version,
+    generation_configs,
+    prompt_text=None,
+    request: gr.Request = None,
+    progress=gr.Progress(),
+    cancel_group="text",
+):
+    """Generate a single clip, yielding `(sample_rate, chunk)` pairs for a streaming `gr.Audio`
+    as soon as each window of `STREAM_CHUNK_SECONDS` is decoded. Autoregressive models
+    continue each window from the end of the previous one."""
+    with cancel_registry.open(_session(request), cancel_group) as token:
+        try:
+            with metrics.request("predict_stream", model_version, collect=False):
+                yield from _predict_stream(token, model_version, generation_configs, prompt_text, progress)
+        except Cancelled:
+            raise gr.Error("Interrupted.")
+
+def _predict_stream(cancel_token, model_version, generation_configs, prompt_text, progress):
+    progress(0, desc="Loading model...")
+    if isinstance(generation_configs, str):
+        generation_configs = ast.literal_eval(generation_configs)
+    model = load_model(model_version)
+
+    def _progress(done, total):
+        progress((round(done, 1), total), unit="seconds")
+        cancel_token.raise_if_cancelled()
+
+    if isinstance(model, timed_import("audiocraft.models").MAGNeT):
+        # MAGNeT decodes every timestep in parallel, nothing is ready before it finishes
+        # the streaming audio component plays files, not encoded clips
+        outputs = _do_predictions(
+            model_version, model, prompt_text, progress_callback=None, cancel_token=cancel_token,
+            in_memory=False, **generation_configs
+        )
+        yield outputs.clips[0]
+        return
+    duration = generation_configs.get("duration", model.duration)
+    be = time.time()
+    for i, (window, prompt_length) in enumerate(_continuation_windows(
+        model_version, model, generation_configs, prompt_text, duration,
+        STREAM_CHUNK_SECONDS, STREAM_CONTEXT_SECONDS, _progress,
+    )):
+        if i == 0:
+            print("time to first chunk", time.time() - be)
+        yield model.sample_rate, _to_int16(window[..., prompt_length:])
+    print("stream finished", time.time() - be)
+
+
+LONGFORM_WINDOW_SECONDS = 20
+LONGFORM_CONTEXT_SECONDS = 10
+LONGFORM_CROSSFADE_SECONDS = 2
+
+def predict_long(
+    model_version,
+    generation_configs,
+    duration,
+    prompt_text=None,
+    prompt_wav=None,
+    request: gr.Request = None,
+    progress=gr.Progress(),
+    cancel_group="text",
+):
+    """
+    Generate a track of `duration` seconds, beyond the model's 30 s limit, with MusicGen.
+
+    Windows of `LONGFORM_WINDOW_SECONDS` of new audio each continue from the last
+    `LONGFORM_CONTEXT_SECONDS` of the track (or of `prompt_wav`). The re-decoded context of a
+    window is crossfaded over the end of the track, so the joins don't click, and every window
+    is appended to the WAV file as soon as it is decoded: memory stays flat with the length.
+    """
+    with cancel_registry.open(_session(request), cancel_group) as token:
+        try:
+            with metrics.request("predict_long", model_version):
+                return _predict_long(
+                    token, model_version, generation_configs, duration, prompt_text, prompt_wav, progress
+                )
+        except Cancelled:
+            raise gr.Error("Interrupted.")
+
+def _predict_long(cancel_token, model_version, generation_configs, duration, prompt_text, prompt_wav, progress):
+    import torch
+    progress(0, desc="Loading model...")
+    if isinstance(generation_configs, str):
+        generation_configs = ast.literal_eval(generation_configs)
+    model = load_model(model_version)
+    if not isinstance(model, timed_import("audiocraft.models").MusicGen):
+        raise gr.Error("Long-form generation needs a MusicGen model.")
+    context = None
+    if prompt_wav is not None:
+        context, _ = process_audio(prompt_wav, LONGFORM_CONTEXT_SECONDS, model)
+
+    def _progress(done, total):
+        progress((round(done, 1), total), unit="seconds")
+        cancel_token.raise_if_cancelled()
+
+    crossfade_length = int(LONGFORM_CROSSFADE_SECONDS * model.sample_rate)
+    fade_in = torch.linspace(0, 1, crossfade_length)
+    tail = None
+    be = time.time()
+    # registered right away, so that a cancelled track is cleaned up too
+    path = artifact_store.new_file(".wav")
+    with artifact_store.pinned(path), open(path, "wb") as file:
+        with wave.open(file, "wb") as writer:
+            writer.setnchannels(model.audio_channels)
+            writer.setsampwidth(2)
+            writer.setframerate(model.sample_rate)
+            window_be = time.time()
+            for window, prompt_length in _continuation_windows(
+                model_version, model, generation_configs, prompt_text, duration,
+                LONGFORM_WINDOW_SECONDS, LONGFORM_CONTEXT_SECONDS, _progress, context,
+            ):
+                new_audio = window[..., prompt_length:]
+                if tail is None:
+                    # the track starts with the prompt, if any
+                    body = window
+                else:
+                    # the held back end of the track and its re-decoded version in this window
+                    redecoded = window[..., prompt_length - tail.shape[-1]:prompt_length]
+                    fade = fade_in[-tail.shape[-1]:]
+                    body = torch.cat([tail * (1 - fade) + redecoded * fade, new_audio], dim=-1)
+                # hold back the end of the track to crossfade it with the next window
+                tail = body[..., -crossfade_length:]
+                writer.writeframes(_to_int16(body[..., :-crossfade_length]).tobytes())
+                seconds = new_audio.shape[-1] / model.sample_rate
+                elapsed = time.time() - window_be
+                print(f"long-form window: {seconds:.1f}s of audio in {elapsed:.1f}s ({seconds / elapsed:.2f}x real time)")
+                window_be = time.time()
+            writer.writeframes(_to_int16(tail).tobytes())
+    print("long-form generation finished", duration, time.time() - be)
+    return path
 
 
 def transcribe(audio_path):
     """
-    Transcribe an audio file to MIDI using the basic_pitch model.
+    Transcribe generated audio to MIDI using the basic_pitch model.
+
+    `audio_path` is the result of `predict`, or a list of paths or `(waveform, sample_rate)` pairs.
     """
-    # model_output, midi_data, note_events = predict("generated_0.wav")
-    tmp_paths = ast.literal_eval(audio_path)
+    audio_path = [clip_store.path(ref) if ClipStore.is_clip(ref) else ref for ref in clip_refs(audio_path)]
     download_buttons = []
-    for audio_path in tmp_paths:
-        model_output, midi_data, note_events = basic_pitch.inference.predict(
-            audio_path=audio_path,
-            model_or_model_path=ICASSP_2022_MODEL_PATH,
-        )
-
-        with NamedTemporaryFile("wb", suffix=".mid", delete=False) as file:
+    for midi_data in transcription_engine.transcribe(audio_path):
+        with artifact_store.pinned(artifact_store.new_file(".mid")) as path, open(path, "wb") as file:
             try:
                 midi_data.write(file)
                 print(f"midi file saved to {file.name}")
@@ -275,8 +862,37 @@ def transcribe(audio_path):
         download_buttons.append(gr.DownloadButton(
             value=file.name, label=f"Download MIDI file {file.name}", visible=True
         ))
-        file_cleaner.add(file.name)
 
     return download_buttons
 
 
+TRANSCRIPTION_TIMEOUT = float(os.getenv("TRANSCRIPTION_TIMEOUT", 300))
+
+def transcription_results(result):
+    """
+    MIDI files of the clips of a `predict(transcribe_midi=True)` result, queued for background
+    transcription, waiting for the ones still running up to `TRANSCRIPTION_TIMEOUT` seconds overall.
+    Clips whose transcription failed or timed out are left out.
+    """
+    deadline = time.time() + TRANSCRIPTION_TIMEOUT
+    midis = []
+    for ref in clip_refs(result):
+        try:
+            midis.append(_transcription_result(ref, max(deadline - time.time(), 0)))
+        except Exception as e:
+            # concurrent.futures.TimeoutError included
+            print(f"No transcription for {ref}: {e!r}")
+    return midis
+
+def _transcription_result(ref, timeout=None):
+    if not ClipStore.is_clip(ref):
+        return transcription_queue.result(ref, timeout)
+    try:
+        return transcription_queue.result(None, timeout, key=ClipStore.content_hash(ref))
+    except KeyError:
+        # not queued anymore (or its MIDI file was cleaned up), transcribe the clip from a file
+        return transcription_queue.result(clip_store.path(ref), timeout)
+
+def clip_value(ref):
+    """Value of a `gr.Audio` showing the output `ref` of `predict`."""
+    return clip_store.value(ref)
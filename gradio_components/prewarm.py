@@ -0,0 +1,89 @@
+import threading
+import time
+import typing as tp
+from concurrent.futures import Future
+
+from gradio_components.startup import timed_import
+
+
+class Prewarmer:
+    """Loads checkpoints in background threads at startup and runs a tiny generation on each,
+    so the first request does not pay for the download, load and first-call kernel warmup.
+
+    `status` maps each checkpoint to "pending", "loading", "warming", "ready" or "failed",
+    and `readiness()` is what the readiness endpoint reports. Warmups run elsewhere, in the
+    worker processes, are reported with `track`.
+    """
+    def __init__(self, load_model: tp.Callable, model_lock: tp.Callable, warmup_duration: float = 1.0):
+        self.load_model = load_model
+        self.model_lock = model_lock
+        self.warmup_duration = warmup_duration
+        self.status: tp.Dict[str, str] = {}
+        self.errors: tp.Dict[str, str] = {}
+        self.warmup_times: tp.Dict[str, float] = {}
+        self._threads: tp.List[threading.Thread] = []
+
+    def start(self, versions: tp.Sequence[str]):
+        for version in versions:
+            self.status[version] = "pending"
+            thread = threading.Thread(target=self._warm, args=(version,), name=f"prewarm-{version}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def warmup(self, version: str):
+        """Load `version` and run a tiny generation on it, raising if either fails."""
+        self.status[version] = "loading"
+        model = self.load_model(version)
+        self.status[version] = "warming"
+        models = timed_import("audiocraft.models")
+        with self.model_lock(version):
+            model.set_custom_progress_callback(lambda generated, to_generate: None)
+            if isinstance(model, models.MAGNeT):
+                # MAGNeT has a fixed generation length, keep its default params
+                model.set_generation_params()
+            else:
+                model.set_generation_params(duration=self.warmup_duration)
+            model.generate(descriptions=["warmup"], progress=False)
+
+    def track(self, name: str, future: Future):
+        """Report a warmup running elsewhere as `name`, e.g. "<checkpoint>@worker0", done with `future`."""
+        be = time.time()
+        self.status[name] = "warming"
+        self.errors.pop(name, None)
+
+        def _done(future: Future):
+            if future.exception() is not None:
+                print(f"Error while prewarming {name}: {future.exception()}")
+                self.status[name] = "failed"
+                self.errors[name] = str(future.exception())
+                return
+            self.warmup_times[name] = time.time() - be
+            self.status[name] = "ready"
+            print(f"Prewarmed {name} in {self.warmup_times[name]:.2f}s")
+
+        future.add_done_callback(_done)
+
+    def _warm(self, version: str):
+        be = time.time()
+        try:
+            self.warmup(version)
+        except Exception as e:
+            print(f"Error while prewarming {version}: {e}")
+            self.status[version] = "failed"
+            self.errors[version] = str(e)
+            return
+        self.warmup_times[version] = time.time() - be
+        self.status[version] = "ready"
+        print(f"Prewarmed {version} in {self.warmup_times[version]:.2f}s")
+
+    @property
+    def ready(self) -> bool:
+        return all(status == "ready" for status in self.status.values())
+
+    def readiness(self) -> dict:
+        return {
+            "ready": self.ready,
+            "models": dict(self.status),
+            "errors": dict(self.errors),
+            "warmup_times": {k: round(v, 2) for k, v in self.warmup_times.items()},
+        }
@@ -0,0 +1,39 @@
+import dataclasses
+import typing as tp
+
+
+@dataclasses.dataclass
+class GenerationResult:
+    """Outputs of one `predict` request, handed to the UI as a JSON value and read back from it.
+
+    `clips` are `ClipStore` references or file paths, None for the clips of a partial result
+    that are not encoded yet. `durations` are in seconds and `timings` maps a stage
+    (generation, encode, request) to its wall time in seconds.
+    """
+    clips: tp.List[str]
+    model: str = ""
+    durations: tp.List[float] = dataclasses.field(default_factory=list)
+    sample_rate: int = 0
+    timings: tp.Dict[str, float] = dataclasses.field(default_factory=dict)
+    cache_hit: bool = False
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, value: tp.Union["GenerationResult", dict]) -> "GenerationResult":
+        if isinstance(value, cls):
+            return value
+        names = {field.name for field in dataclasses.fields(cls)}
+        # unknown keys are ignored, e.g. from a newer version of the payload
+        return cls(**{k: v for k, v in value.items() if k in names})
+
+
+def clip_refs(value) -> list:
+    """Clips of a `GenerationResult`, of its dict form, or a list of clips as is, without the
+    clips of a partial result that are not encoded yet."""
+    if not value:
+        return []
+    if isinstance(value, (GenerationResult, dict)):
+        value = GenerationResult.from_dict(value).clips
+    return [ref for ref in value if ref is not None]
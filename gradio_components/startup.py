@@ -0,0 +1,38 @@
+import importlib
+import json
+import sys
+import time
+import typing as tp
+
+STARTED_AT = time.perf_counter()
+# module name -> seconds its first import took, in import order
+IMPORT_TIMES: tp.Dict[str, float] = {}
+
+
+def timed_import(name: str):
+    """Import `name`, recording how long the first import took.
+
+    Heavy frameworks (torch, audiocraft, basic-pitch/TensorFlow) are imported through this
+    on first use instead of at module level, so the report shows when and what they cost.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    be = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - be
+    print(f"imported {name} in {IMPORT_TIMES[name]:.2f}s")
+    return module
+
+
+def startup_report() -> dict:
+    return {
+        "uptime": round(time.perf_counter() - STARTED_AT, 3),
+        "imports": {name: round(seconds, 3) for name, seconds in IMPORT_TIMES.items()},
+        "heavy_frameworks_loaded": [
+            name for name in ("torch", "torchaudio", "audiocraft", "tensorflow", "basic_pitch") if name in sys.modules
+        ],
+    }
+
+
+def print_startup_report():
+    print("startup report", json.dumps(startup_report(), indent=2))
@@ -0,0 +1,214 @@
+import queue
+import threading
+import time
+import typing as tp
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+
+from gradio_components import metrics
+from gradio_components.startup import timed_import
+from gradio_components.utils import hash_file
+
+# same windowing as basic_pitch.inference.run_inference
+N_OVERLAPPING_FRAMES = 30
+# basic_pitch.constants, kept here since importing basic_pitch loads TensorFlow
+AUDIO_SAMPLE_RATE = 22050
+FFT_HOP = 256
+AUDIO_N_SAMPLES = AUDIO_SAMPLE_RATE * 2 - FFT_HOP
+OVERLAP_LEN = N_OVERLAPPING_FRAMES * FFT_HOP
+HOP_SIZE = AUDIO_N_SAMPLES - OVERLAP_LEN
+
+AudioInput = tp.Union[str, Path, tp.Tuple[tp.Any, int]]
+
+
+def _temporary_file(suffix: str) -> str:
+    with NamedTemporaryFile("wb", suffix=suffix, delete=False) as file:
+        return file.name
+
+
+class TranscriptionEngine:
+    """Audio to MIDI transcription with a resident basic-pitch model.
+
+    `basic_pitch.inference.predict` loads the model from its path and runs one window at
+    a time on every call. Here the model is loaded once, and the windows of every clip of a
+    request go through the model together, `max_batch_windows` at a time.
+    """
+    def __init__(self, model_path=None, max_batch_windows: int = 64):
+        # defaults to basic_pitch.ICASSP_2022_MODEL_PATH, resolved on first use
+        self.model_path = model_path
+        self.max_batch_windows = max_batch_windows
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                basic_pitch = timed_import("basic_pitch")
+                inference = timed_import("basic_pitch.inference")
+                be = time.time()
+                self._model = inference.Model(self.model_path or basic_pitch.ICASSP_2022_MODEL_PATH)
+                print("Loaded basic-pitch model in", time.time() - be)
+            return self._model
+
+    @staticmethod
+    def _load(audio: AudioInput) -> np.ndarray:
+        """Mono float32 audio at basic-pitch's sample rate, from a path or a `(wav, sample_rate)` pair."""
+        librosa = timed_import("librosa")
+        if isinstance(audio, (str, Path)):
+            wav, _ = librosa.load(str(audio), sr=AUDIO_SAMPLE_RATE, mono=True)
+            return wav
+        wav, sr = audio
+        if hasattr(wav, "detach"):
+            wav = wav.detach().cpu().float().numpy()
+        wav = np.asarray(wav, dtype=np.float32)
+        if wav.ndim == 2:
+            # [C, T] as produced by audiocraft
+            wav = wav.mean(axis=0)
+        if sr != AUDIO_SAMPLE_RATE:
+            wav = librosa.resample(wav, orig_sr=sr, target_sr=AUDIO_SAMPLE_RATE)
+        return wav.astype(np.float32)
+
+    def _windows(self, wav: np.ndarray) -> np.ndarray:
+        inference = timed_import("basic_pitch.inference")
+        wav = np.concatenate([np.zeros((OVERLAP_LEN // 2,), dtype=np.float32), wav])
+        return np.stack([window for window, _ in inference.window_audio_file(wav, HOP_SIZE)])
+
+    def run_inference(self, audios: tp.Sequence[AudioInput]) -> tp.List[tp.Dict[str, np.ndarray]]:
+        """Raw note/onset/contour activations for each input, as `basic_pitch.inference.run_inference`."""
+        inference = timed_import("basic_pitch.inference")
+        wavs = [self._load(audio) for audio in audios]
+        windows = [self._windows(wav) for wav in wavs]
+        batch = np.concatenate(windows)
+        output: tp.Dict[str, tp.List[np.ndarray]] = {"note": [], "onset": [], "contour": []}
+        for start in range(0, len(batch), self.max_batch_windows):
+            for k, v in self.model.predict(batch[start:start + self.max_batch_windows]).items():
+                output[k].append(v)
+        stacked = {k: np.concatenate(v) for k, v in output.items()}
+        results = []
+        offset = 0
+        for wav, clip_windows in zip(wavs, windows):
+            results.append({
+                k: inference.unwrap_output(v[offset:offset + len(clip_windows)], len(wav), N_OVERLAPPING_FRAMES)
+                for k, v in stacked.items()
+            })
+            offset += len(clip_windows)
+        return results
+
+    def transcribe(
+        self,
+        audios: tp.Sequence[AudioInput],
+        onset_threshold: float = 0.5,
+        frame_threshold: float = 0.3,
+        minimum_note_length: float = 127.70,
+        midi_tempo: float = 120,
+    ):
+        """Transcribe every input to a `pretty_midi.PrettyMIDI`, with basic-pitch's default thresholds."""
+        note_creation = timed_import("basic_pitch.note_creation")
+        be = time.time()
+        min_note_len = int(np.round(minimum_note_length / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+        midis = []
+        with metrics.span("transcription", "basic-pitch"):
+            for model_output in self.run_inference(audios):
+                midi_data, _ = note_creation.model_output_to_notes(
+                    model_output,
+                    onset_thresh=onset_threshold,
+                    frame_thresh=frame_threshold,
+                    min_note_len=min_note_len,
+                    midi_tempo=midi_tempo,
+                )
+                midis.append(midi_data)
+        print("transcription finished", len(audios), time.time() - be)
+        return midis
+
+
+class TranscriptionQueue:
+    """Transcribes generated clips to MIDI on a background thread.
+
+    Clips are submitted as soon as they are written, and jobs waiting in the queue are
+    transcribed together by the engine. Results are cached by audio content hash, so the
+    same clip (e.g. served again from the audio cache) is only transcribed once.
+    `new_file(suffix)` returns the path each MIDI file is written to, temporary files by default.
+    """
+    def __init__(self, engine: TranscriptionEngine, new_file: tp.Optional[tp.Callable[[str], str]] = None,
+                 max_batch: int = 8, max_cached: int = 512):
+        self.engine = engine
+        self.new_file = new_file or _temporary_file
+        self.max_batch = max_batch
+        self.max_cached = max_cached
+        self._jobs: "queue.Queue[tp.Tuple[str, AudioInput, Future]]" = queue.Queue()
+        self._futures: tp.OrderedDict[str, Future] = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: tp.Optional[threading.Thread] = None
+
+    def submit(self, path: tp.Optional[tp.Union[str, Path]], waveform: tp.Optional[tp.Tuple[tp.Any, int]] = None,
+               key: tp.Optional[str] = None) -> Future:
+        """Queue `path` for transcription, using the in-memory `(waveform, sample_rate)` if given.
+
+        `key` is the content hash of the clip, when it is not a file (yet).
+        """
+        key = key or hash_file(path)
+        with self._lock:
+            future = self._futures.get(key)
+            # the MIDI file may have been cleaned up since, transcribe again then
+            stale = future is not None and future.done() and not future.exception() \
+                and not Path(future.result()).exists()
+            if future is not None and not stale:
+                self._futures.move_to_end(key)
+                return future
+            if path is None and waveform is None:
+                raise KeyError(f"{key} is not queued for transcription")
+            future = Future()
+            self._futures[key] = future
+            while len(self._futures) > self.max_cached:
+                self._futures.popitem(last=False)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="transcription", daemon=True)
+                self._thread.start()
+        self._jobs.put((key, waveform if waveform is not None else str(path), future))
+        return future
+
+    def result(self, path: tp.Optional[tp.Union[str, Path]], timeout: tp.Optional[float] = None,
+               key: tp.Optional[str] = None) -> str:
+        """Path of the MIDI transcription of `path`, waiting for it if needed."""
+        return self.submit(path, key=key).result(timeout)
+
+    def _run(self):
+        while True:
+            jobs = [self._jobs.get()]
+            while len(jobs) < self.max_batch:
+                try:
+                    jobs.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                midis = self.engine.transcribe([audio for _, audio, _ in jobs])
+                if len(midis) != len(jobs):
+                    raise RuntimeError(f"{len(midis)} transcriptions for {len(jobs)} clips")
+            except Exception as e:
+                print(f"Error while transcribing: {e}")
+                for job in jobs:
+                    self._fail(job, e)
+                continue
+            for job, midi_data in zip(jobs, midis):
+                # every future is resolved and the thread keeps running, whatever fails
+                try:
+                    path = self.new_file(".mid")
+                    midi_data.write(path)
+                except Exception as e:
+                    print(f"Error while writing midi file: {e}")
+                    self._fail(job, e)
+                    continue
+                job[2].set_result(path)
+
+    def _fail(self, job, error: Exception):
+        key, _, future = job
+        future.set_exception(error)
+        with self._lock:
+            # submitted again next time, instead of failing from the cache
+            if self._futures.get(key) is future:
+                del self._futures[key]
@@ -0,0 +1,66 @@
+import hashlib
+import threading
+import typing as tp
+from collections import OrderedDict
+from pathlib import Path
+
+
+def hash_file(path: tp.Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """sha256 of a file's content, read in chunks so large uploads stay out of memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_audio_input(audio) -> str:
+    """Content hash of a gradio audio input, either a filepath or a (sample_rate, numpy array) tuple."""
+    if isinstance(audio, (tuple, list)):
+        sr, data = audio
+        digest = hashlib.sha256(str(sr).encode())
+        digest.update(data.tobytes())
+        return digest.hexdigest()
+    return hash_file(audio)
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache bounded by the total `size_of` its values,
+    by default the number of entries."""
+    def __init__(self, max_size: float = 128, size_of: tp.Callable[[tp.Any], float] = lambda value: 1):
+        self.max_size = max_size
+        self.size_of = size_of
+        self.hits = 0
+        self.misses = 0
+        self._entries: tp.OrderedDict[tp.Hashable, tp.Tuple[tp.Any, float]] = OrderedDict()
+        self._size = 0.
+        self._lock = threading.Lock()
+
+    def get(self, key: tp.Hashable, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: tp.Hashable, value):
+        size = self.size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def __contains__(self, key: tp.Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "size": self._size}
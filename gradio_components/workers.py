@@ -0,0 +1,176 @@
+import multiprocessing
+import threading
+import typing as tp
+from collections import Counter
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from gradio_components.cancellation import Cancelled
+
+
+class WorkerPool:
+    """Runs generations in `num_workers` separate processes, each with its own model registry.
+
+    Every worker is a single-process executor, so the checkpoints it loaded stay resident
+    between requests. A request is routed to the least busy worker that already holds its
+    checkpoint, unless that worker has `max_imbalance` more queued requests than the least
+    busy one, in which case the latter loads the checkpoint too.
+
+    Jobs run in the worker return `(result, resident)`, `resident` being the checkpoints the
+    worker holds afterwards, which keeps the routing table in sync with worker evictions.
+    A worker that dies (e.g. killed when out of memory) is replaced by a new process, which
+    preloads the checkpoints the dead one was given at startup.
+    """
+    def __init__(self, max_imbalance: int = 2):
+        self.max_imbalance = max_imbalance
+        self.executors: tp.List[ProcessPoolExecutor] = []
+        self.resident: tp.List[tp.Set[str]] = []
+        self.pending: tp.List[tp.Counter[str]] = []
+        self.respawns = 0
+        self._preloads: tp.List[tp.List[str]] = []
+        self._preload: tp.Optional[tp.Callable] = None
+        self._on_preload: tp.Optional[tp.Callable[[str, Future], None]] = None
+        self._context = None
+        # cancel flags shared with the workers
+        self._manager = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.executors)
+
+    def start(self, num_workers: int, preload: tp.Callable, versions: tp.Sequence[str] = (),
+              on_preload: tp.Optional[tp.Callable[[str, Future], None]] = None):
+        """Spawn the workers and have them run `preload(version)` for `versions`, spread round
+        robin across them. `on_preload("<version>@worker<i>", future)` is called for each preload."""
+        # CUDA can't be re-initialized in a forked process
+        self._context = multiprocessing.get_context("spawn")
+        self._preload = preload
+        self._on_preload = on_preload
+        self._manager = self._context.Manager()
+        self.executors = [ProcessPoolExecutor(1, mp_context=self._context) for _ in range(num_workers)]
+        self.resident = [set() for _ in range(num_workers)]
+        self.pending = [Counter() for _ in range(num_workers)]
+        self._preloads = [[] for _ in range(num_workers)]
+        for i, version in enumerate(versions):
+            self._preloads[i % num_workers].append(version)
+        for i in range(num_workers):
+            self._run_preloads(i)
+
+    def _run_preloads(self, worker: int):
+        for version in self._preloads[worker]:
+            future = self._submit(worker, version, self._preload, version)
+            if self._on_preload is not None:
+                self._on_preload(f"{version}@worker{worker}", future)
+
+    def _respawn(self, worker: int, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._closed or self.executors[worker] is not executor:
+                # shutting down, or already replaced by another job of the dead worker
+                return
+            print(f"Worker {worker} died, starting a new one")
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.executors[worker] = ProcessPoolExecutor(1, mp_context=self._context)
+            self.resident[worker] = set()
+            self.respawns += 1
+        self._run_preloads(worker)
+
+    def depth(self, worker: int) -> int:
+        return sum(self.pending[worker].values())
+
+    def route(self, model_version: str) -> int:
+        with self._lock:
+            least_busy = min(range(len(self.executors)), key=self.depth)
+            # a checkpoint queued on a worker counts as held by it, it is loaded by the time the request runs
+            owners = [
+                i for i in range(len(self.executors))
+                if model_version in self.resident[i] or self.pending[i][model_version]
+            ]
+            if owners:
+                owner = min(owners, key=self.depth)
+                if self.depth(owner) - self.depth(least_busy) <= self.max_imbalance:
+                    return owner
+            return least_busy
+
+    def submit(self, model_version: str, fn: tp.Callable, *args, cancel_token=None) -> Future:
+        """Run `fn(*args)` on the worker chosen for `model_version`, returning a future of its result.
+
+        Cancelling `cancel_token` fails the future right away, and drops the job if the
+        worker has not started it yet. A job already running gets it as the `cancel_event`
+        keyword argument of `fn`, an `Event` set on cancellation, which it is expected to check
+        (e.g. in its progress callback) to stop early.
+        """
+        cancel_event = self._manager.Event() if cancel_token is not None else None
+        return self._submit(
+            self.route(model_version), model_version, fn, *args, cancel_token=cancel_token, cancel_event=cancel_event
+        )
+
+    def _submit(self, worker: int, model_version: str, fn: tp.Callable, *args, cancel_token=None,
+                cancel_event=None) -> Future:
+        result: Future = Future()
+        with self._lock:
+            self.pending[worker][model_version] += 1
+            executor = self.executors[worker]
+
+        def _done(future: Future):
+            with self._lock:
+                self.pending[worker][model_version] -= 1
+                if not future.cancelled() and future.exception() is None:
+                    self.resident[worker] = set(future.result()[1])
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._respawn(worker, executor)
+            try:
+                if future.cancelled():
+                    result.set_exception(Cancelled())
+                elif future.exception() is not None:
+                    if not isinstance(future.exception(), Cancelled):
+                        print(f"Error in worker {worker}: {future.exception()}")
+                    result.set_exception(future.exception())
+                else:
+                    result.set_result(future.result()[0])
+            except InvalidStateError:
+                # already failed by the cancellation
+                pass
+
+        kwargs = {"cancel_event": cancel_event} if cancel_event is not None else {}
+        try:
+            job = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # died since its last job finished, run on its replacement
+            with self._lock:
+                self.pending[worker][model_version] -= 1
+            self._respawn(worker, executor)
+            return self._submit(
+                worker, model_version, fn, *args, cancel_token=cancel_token, cancel_event=cancel_event
+            )
+        job.add_done_callback(_done)
+        if cancel_token is not None:
+            def _cancel():
+                # dropped if queued, stopped at its next progress update if running
+                job.cancel()
+                if cancel_event is not None:
+                    cancel_event.set()
+                try:
+                    result.set_exception(Cancelled())
+                except InvalidStateError:
+                    pass
+            cancel_token.add_callback(_cancel)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": [
+                    {"resident": sorted(self.resident[i]), "queued": self.depth(i)}
+                    for i in range(len(self.executors))
+                ],
+                "respawns": self.respawns,
+            }
+
+    def shutdown(self):
+        self._closed = True
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from gradio_components.artifacts import ArtifactStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    # sweeps are run by the tests, not the background thread
+    store = ArtifactStore(tmp_path, file_lifetime=3600, max_bytes=1000, sweep_interval=3600)
+    yield store
+    store.close()
+
+
+def write(store, size, suffix=".wav"):
+    path = store.new_file(suffix)
+    Path(path).write_bytes(b"x" * size)
+    store.add(path)
+    return Path(path)
+
+
+def test_sweep_removes_the_oldest_files_over_quota(store):
+    paths = [write(store, 400) for _ in range(4)]
+    store.sweep()
+    assert [path.exists() for path in paths] == [False, False, True, True]
+    assert store.stats() == {"files": 2, "bytes": 800, "pinned": 0}
+
+
+def test_sweep_removes_expired_files(store):
+    old = write(store, 10)
+    store.file_lifetime = 0
+    store.sweep()
+    assert not old.exists()
+    store.file_lifetime = 3600
+    new = write(store, 10)
+    store.sweep()
+    assert new.exists()
+
+
+def test_sweep_keeps_pinned_files(store):
+    paths = [write(store, 600) for _ in range(2)]
+    store.pin(paths[0])
+    store.sweep()
+    assert paths[0].exists() and not paths[1].exists()
+    store.unpin(paths[0])
+    store.max_bytes = 0
+    store.sweep()
+    assert not paths[0].exists()
+
+
+def test_sweep_leaves_discarded_files(store, tmp_path):
+    path = write(store, 2000)
+    moved = tmp_path / "moved.wav"
+    path.rename(moved)
+    store.discard(path)
+    store.sweep()
+    assert moved.exists()
+    assert store.stats()["bytes"] == 0
+
+
+def test_pinned_file_is_accounted_once_written(store):
+    with store.pinned(store.new_file(".wav")) as path:
+        Path(path).write_bytes(b"x" * 300)
+    assert store.stats() == {"files": 1, "bytes": 300, "pinned": 0}
+
+
+def test_startup_removes_the_files_of_dead_processes(tmp_path):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    dead = tmp_path / str(process.pid)
+    alive = tmp_path / str(os.getppid())
+    # a previous process with the same pid, e.g. after a container restart
+    own = tmp_path / str(os.getpid())
+    for directory in (dead, alive, own):
+        directory.mkdir()
+        (directory / "clip.wav").write_bytes(b"x")
+    store = ArtifactStore(tmp_path, sweep_interval=3600)
+    try:
+        write(store, 10)
+        assert not dead.exists()
+        assert (alive / "clip.wav").exists()
+        assert not (own / "clip.wav").exists()
+        assert store.stats()["files"] == 1
+    finally:
+        store.close()
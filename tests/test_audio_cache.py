@@ -0,0 +1,56 @@
+from pathlib import Path
+
+from gradio_components.audio_cache import AudioCache
+
+
+def clips(tmp_path, name, size, count=1):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"{name}-{i}.wav"
+        path.write_bytes(b"x" * size)
+        paths.append(str(path))
+    return paths
+
+
+def test_put_moves_the_clips_and_get_returns_them(tmp_path):
+    cache = AudioCache(tmp_path / "cache")
+    sources = clips(tmp_path, "a", 10, count=2)
+    cached = cache.put("a", sources, meta={"model": "m"})
+    assert not any(Path(path).exists() for path in sources)
+    assert cache.get("a") == cached
+    assert cache.meta("a") == {"model": "m"}
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted_over_size(tmp_path):
+    cache = AudioCache(tmp_path / "cache", max_bytes=250, grace_period=0)
+    for key in "abc":
+        cache.put(key, clips(tmp_path, key, 100))
+        if key == "b":
+            # a is used again, b becomes the least recently used
+            assert cache.get("a")
+    assert cache.get("b") is None
+    assert not (tmp_path / "cache" / "b").exists()
+    assert cache.get("a") and cache.get("c")
+
+
+def test_recently_served_entries_are_not_evicted(tmp_path):
+    cache = AudioCache(tmp_path / "cache", max_bytes=150, grace_period=300)
+    for key in "ab":
+        cache.put(key, clips(tmp_path, key, 100))
+    # over size, but both were used within the grace period
+    assert cache.get("a") and cache.get("b")
+
+
+def test_index_is_reloaded_from_disk(tmp_path):
+    cache = AudioCache(tmp_path / "cache")
+    cache.put("a", clips(tmp_path, "a", 10))
+    reloaded = AudioCache(tmp_path / "cache")
+    assert reloaded.get("a") == cache.get("a")
+
+
+def test_key_depends_on_format_and_precision_only_when_not_default():
+    args = ("m", "lofi", {"duration": 10}, None, 1, 2)
+    assert AudioCache.key(*args) == AudioCache.key(*args, "wav", "fp32")
+    assert len({AudioCache.key(*args), AudioCache.key(*args, "mp3"), AudioCache.key(*args, "wav", "int8")}) == 3
@@ -0,0 +1,148 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from gradio_components.batching import BatchScheduler
+from gradio_components.cancellation import CancelToken, Cancelled
+
+
+class FakeModel:
+    """Records the batches it generates, an output being its description."""
+    def __init__(self, steps=3, step_time=0.0):
+        self.steps = steps
+        self.step_time = step_time
+        self.batches = []
+        self.progress_callback = None
+
+    def set_custom_progress_callback(self, callback):
+        self.progress_callback = callback
+
+
+def generate(model, configs, descriptions):
+    model.batches.append(list(descriptions))
+    for step in range(model.steps):
+        time.sleep(model.step_time)
+        model.progress_callback(step + 1, model.steps)
+    return list(descriptions)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def lock():
+    return threading.Lock()
+
+
+def queued(scheduler):
+    with scheduler._cond:
+        return sum(len(pending) for pending in scheduler._pending.values())
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_slice(lock):
+    scheduler = BatchScheduler(lambda version: lock, window=0.01)
+    model = FakeModel()
+    with ThreadPoolExecutor(3) as pool:
+        with lock:
+            futures = [
+                pool.submit(scheduler.generate, "m", model, generate, {"duration": 1}, text, n)
+                for text, n in (("a", 1), ("b", 2), ("c", 3))
+            ]
+            wait_for(lambda: queued(scheduler) == 3)
+        results = [future.result(5) for future in futures]
+    assert results == [["a"], ["b", "b"], ["c", "c", "c"]]
+    assert len(model.batches) == 1
+
+
+def test_different_configs_are_not_batched(lock):
+    scheduler = BatchScheduler(lambda version: lock, window=0.01)
+    model = FakeModel()
+    with ThreadPoolExecutor(2) as pool:
+        with lock:
+            futures = [
+                pool.submit(scheduler.generate, "m", model, generate, {"duration": duration}, "a", 1)
+                for duration in (1, 2)
+            ]
+            wait_for(lambda: queued(scheduler) == 2)
+        assert [future.result(5) for future in futures] == [["a"], ["a"]]
+    assert len(model.batches) == 2
+
+
+def test_max_batch_size_hands_the_rest_to_the_next_leader(lock):
+    scheduler = BatchScheduler(lambda version: lock, window=0.01, max_batch_size=2)
+    model = FakeModel()
+    with ThreadPoolExecutor(3) as pool:
+        with lock:
+            futures = [pool.submit(scheduler.generate, "m", model, generate, {}, text, 1) for text in "abc"]
+            wait_for(lambda: queued(scheduler) == 3)
+        assert [future.result(5) for future in futures] == [["a"], ["b"], ["c"]]
+    assert sorted(len(batch) for batch in model.batches) == [1, 2]
+
+
+def test_cancelled_leader_hands_over_the_leadership(lock):
+    scheduler = BatchScheduler(lambda version: lock, window=0.01)
+    model = FakeModel()
+    token = CancelToken()
+    with ThreadPoolExecutor(2) as pool:
+        with lock:
+            leader = pool.submit(scheduler.generate, "m", model, generate, {}, "a", 1, None, token)
+            wait_for(lambda: queued(scheduler) == 1)
+            follower = pool.submit(scheduler.generate, "m", model, generate, {}, "b", 1)
+            wait_for(lambda: queued(scheduler) == 2)
+            token.cancel()
+            with pytest.raises(Cancelled):
+                leader.result(5)
+        assert follower.result(5) == ["b"]
+    assert model.batches == [["b"]]
+
+
+def test_batch_is_aborted_once_all_its_requests_are_cancelled(lock):
+    scheduler = BatchScheduler(lambda version: lock, window=0.01)
+    model = FakeModel(steps=1000, step_time=0.01)
+    tokens = [CancelToken(), CancelToken()]
+    with ThreadPoolExecutor(2) as pool:
+        with lock:
+            futures = [
+                pool.submit(scheduler.generate, "m", model, generate, {}, text, 1, None, token)
+                for text, token in zip("ab", tokens)
+            ]
+            wait_for(lambda: queued(scheduler) == 2)
+        wait_for(lambda: model.batches)
+        tokens[0].cancel()
+        # the other request still receives progress, the batch keeps running
+        time.sleep(0.05)
+        assert lock.locked()
+        tokens[1].cancel()
+        for future in futures:
+            with pytest.raises(Cancelled):
+                future.result(5)
+        wait_for(lambda: not lock.locked())
+
+
+def test_progress_is_reported_in_the_context_of_each_caller(lock):
+    scheduler = BatchScheduler(lambda version: lock, window=0.01)
+    model = FakeModel()
+    caller = contextvars.ContextVar("caller")
+    seen = {text: set() for text in "ab"}
+
+    def run(text):
+        caller.set(text)
+        return scheduler.generate(
+            "m", model, generate, {}, text, 1, lambda generated, to_generate: seen[text].add(caller.get())
+        )
+
+    with ThreadPoolExecutor(2) as pool:
+        with lock:
+            futures = [pool.submit(run, text) for text in "ab"]
+            wait_for(lambda: queued(scheduler) == 2)
+        for future in futures:
+            future.result(5)
+    assert len(model.batches) == 1
+    assert seen == {"a": {"a"}, "b": {"b"}}
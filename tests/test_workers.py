@@ -0,0 +1,94 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from gradio_components.cancellation import CancelToken, Cancelled
+from gradio_components.workers import WorkerPool
+
+
+# jobs run in the workers, they return (result, checkpoints resident in the worker)
+
+def load(version):
+    return os.getpid(), [version]
+
+
+def crash(version):
+    os._exit(1)
+
+
+def wait_for_cancel(version, cancel_event=None):
+    deadline = time.time() + 30
+    while not cancel_event.is_set():
+        assert time.time() < deadline
+        time.sleep(0.01)
+    raise Cancelled()
+
+
+def routing_pool(resident, pending):
+    pool = WorkerPool(max_imbalance=2)
+    pool.executors = [None] * len(resident)
+    pool.resident = [set(versions) for versions in resident]
+    pool.pending = [Counter(queued) for queued in pending]
+    return pool
+
+
+def test_route_prefers_a_worker_holding_the_checkpoint():
+    pool = routing_pool([{"a"}, set()], [{"a": 2}, {}])
+    assert pool.route("a") == 0
+    assert pool.route("b") == 1
+
+
+def test_route_counts_queued_checkpoints_as_held():
+    pool = routing_pool([set(), set()], [{}, {"a": 1}])
+    assert pool.route("a") == 1
+
+
+def test_route_goes_to_the_least_busy_worker_beyond_the_imbalance():
+    pool = routing_pool([{"a"}, set()], [{"a": 3}, {}])
+    assert pool.route("a") == 1
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool()
+    yield pool
+    pool.shutdown()
+
+
+def test_requests_stick_to_the_worker_that_loaded_their_checkpoint(pool):
+    preloaded = {}
+    pool.start(2, load, ["a", "b"], on_preload=lambda name, future: preloaded.setdefault(name, future))
+    assert sorted(preloaded) == ["a@worker0", "b@worker1"]
+    pids = {name.split("@")[0]: future.result(30) for name, future in preloaded.items()}
+    assert pool.submit("a", load, "a").result(30) == pids["a"]
+    assert pool.submit("b", load, "b").result(30) == pids["b"]
+    assert pool.stats()["workers"] == [{"resident": ["a"], "queued": 0}, {"resident": ["b"], "queued": 0}]
+
+
+def test_dead_worker_is_replaced_and_preloads_again(pool):
+    preloaded = []
+    pool.start(1, load, ["a"], on_preload=lambda name, future: preloaded.append(future))
+    first = preloaded[0].result(30)
+    with pytest.raises(BrokenProcessPool):
+        pool.submit("a", crash, "a").result(30)
+    assert pool.stats()["respawns"] == 1
+    assert len(preloaded) == 2
+    second = preloaded[1].result(30)
+    assert second != first
+    assert pool.submit("a", load, "a").result(30) == second
+
+
+def test_cancel_stops_a_running_job(pool):
+    pool.start(1, load)
+    token = CancelToken()
+    future = pool.submit("a", wait_for_cancel, "a", cancel_token=token)
+    # running, not just queued
+    time.sleep(1)
+    token.cancel()
+    with pytest.raises(Cancelled):
+        future.result(1)
+    # the worker is free again
+    assert isinstance(pool.submit("a", load, "a").result(30), int)